@@ -0,0 +1,115 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+
+THUMBNAIL_FORMATS = {"JPEG": ".jpg", "WEBP": ".webp"}
+
+
+class ContactSheet:
+    """
+    Renders grids of artwork images ("contact sheets") from cached
+    thumbnails.
+
+    A thumbnail is made once per image id and size: the JPEG is opened in
+    draft mode, so it is decoded directly at 1/2, 1/4 or 1/8 scale, then
+    downscaled and saved under `cache_dir` as JPEG or WebP. Later renders
+    load the small file, or reuse it from an in-memory LRU. Thumbnails
+    are loaded in parallel threads (Pillow releases the GIL while
+    decoding).
+    """
+
+    def __init__(self, image_dir, cache_dir=None, size=256, format="JPEG", quality=85, workers=8, memory_items=256):
+        self.image_dir = image_dir
+        self.size = size
+        self.format = format.upper()
+        self.quality = quality
+        self.cache_dir = os.path.join(cache_dir or os.path.join(image_dir, ".thumbnails"), str(size))
+        self.memory_items = memory_items
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnail")
+
+    def _source_path(self, image_id):
+        return os.path.join(self.image_dir, f"{image_id}.jpg")
+
+    def _cache_path(self, image_id):
+        return os.path.join(self.cache_dir, f"{image_id}{THUMBNAIL_FORMATS[self.format]}")
+
+    def _make_thumbnail(self, image_id):
+        source, cached = self._source_path(image_id), self._cache_path(image_id)
+        if os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(source):
+            with Image.open(cached) as img:
+                img.load()
+                return img
+
+        with Image.open(source) as img:
+            img.draft("RGB", (self.size, self.size))  # JPEG DCT scaling, no full-resolution decode
+            img = img.convert("RGB")
+        img.thumbnail((self.size, self.size))
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{cached}.{threading.get_ident()}.tmp"
+        img.save(tmp_path, format=self.format, quality=self.quality)
+        os.replace(tmp_path, cached)
+        return img
+
+    def thumbnail(self, image_id):
+        with self._lock:
+            if image_id in self._memory:
+                self._memory.move_to_end(image_id)
+                return self._memory[image_id]
+
+        img = self._make_thumbnail(image_id)
+        with self._lock:
+            self._memory[image_id] = img
+            if len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+        return img
+
+    def thumbnails(self, image_ids):
+        return list(self._executor.map(self.thumbnail, image_ids))
+
+    def render(self, image_ids, nrow=5):
+        images = self.thumbnails(image_ids)
+
+        # Each column is as wide as its widest image, each row as tall as its tallest
+        nrows = (len(images) + nrow - 1) // nrow
+        max_widths = [0] * nrow
+        max_heights = [0] * nrows
+        for i, img in enumerate(images):
+            row, col = divmod(i, nrow)
+            max_widths[col] = max(max_widths[col], img.width)
+            max_heights[row] = max(max_heights[row], img.height)
+
+        grid_image = Image.new("RGB", (sum(max_widths), sum(max_heights)))
+        y_offset = 0
+        for row in range(nrows):
+            x_offset = 0
+            for col in range(nrow):
+                if row * nrow + col < len(images):
+                    grid_image.paste(images[row * nrow + col], (x_offset, y_offset))
+                x_offset += max_widths[col]
+            y_offset += max_heights[row]
+        return grid_image
+
+    def save(self, filepath, image_ids, nrow=5):
+        self.render(list(image_ids), nrow).save(filepath)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+_sheets = {}
+
+
+def save_images(filepath, image_ids, image_dir, nrow=5, size=256, cache_dir=None):
+    """Save a grid of `image_ids` to `filepath`, reusing one ContactSheet per image_dir and size."""
+    key = (os.path.abspath(image_dir), size, cache_dir)
+    if key not in _sheets:
+        _sheets[key] = ContactSheet(image_dir, cache_dir=cache_dir, size=size)
+    _sheets[key].save(filepath, image_ids, nrow)
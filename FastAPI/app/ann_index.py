@@ -0,0 +1,81 @@
+# ANN Index Builder
+import time
+
+import faiss
+import numpy as np
+
+
+def default_index_specs(n):
+    """Short names for the supported index types, sized for `n` vectors."""
+    nlist = int(max(1, min(4 * np.sqrt(n), n // 39)))  # FAISS wants ~39 training points per list
+    return {
+        "flat": "Flat",
+        "ivf_flat": f"IVF{nlist},Flat",
+        "ivf_pq": f"IVF{nlist},PQ64",
+        "hnsw": "HNSW32",
+        "sq8": "SQ8",
+    }
+
+
+def resolve_index_spec(spec, n):
+    # Accept a short name ("ivf_pq") or any FAISS index_factory string ("IVF1024,PQ32")
+    return default_index_specs(n).get(spec.lower(), spec)
+
+
+def build_index(embeddings, spec="Flat", train_size: int = 50000, search_params=None, seed: int = 0):
+    """
+    Build an L2 index of the given spec over `embeddings`.
+
+    Index types that need training (IVF, PQ, SQ) are trained on a random
+    sample of at most `train_size` rows. `search_params` is a FAISS
+    ParameterSpace string such as "nprobe=16" or "efSearch=128".
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+    n, dimension = embeddings.shape
+    index = faiss.index_factory(dimension, resolve_index_spec(spec, n), faiss.METRIC_L2)
+
+    if not index.is_trained:
+        rng = np.random.default_rng(seed)
+        sample = embeddings[np.sort(rng.choice(n, size=min(n, train_size), replace=False))]
+        index.train(sample)
+    index.add(embeddings)
+
+    if search_params:
+        faiss.ParameterSpace().set_index_parameters(index, search_params)
+    return index
+
+
+def evaluate_index(index, embeddings, k: int = 15, num_queries: int = 200, seed: int = 0):
+    """
+    Compare `index` with exact search on queries sampled from the catalog.
+
+    Returns recall@k against brute force, p50/p99 single-query latency in
+    milliseconds and the serialized index size in bytes.
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+    rng = np.random.default_rng(seed)
+    queries = embeddings[rng.choice(len(embeddings), size=min(num_queries, len(embeddings)), replace=False)]
+    k = min(k, len(embeddings))
+
+    exact = faiss.IndexFlatL2(embeddings.shape[1])
+    exact.add(embeddings)
+    _, truth = exact.search(queries, k)
+
+    # Requests search one vector at a time, so time single-row searches
+    latencies, found = [], []
+    for query in queries:
+        start = time.perf_counter()
+        _, I = index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - start)
+        found.append(I[0])
+
+    recall = np.mean([len(np.intersect1d(f, t)) / k for f, t in zip(found, truth)])
+    latencies_ms = 1000 * np.array(latencies)
+    return {
+        "k": k,
+        "num_queries": len(queries),
+        f"recall@{k}": round(float(recall), 4),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 4),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 4),
+        "index_bytes": int(faiss.serialize_index(index).nbytes),
+    }
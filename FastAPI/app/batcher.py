@@ -0,0 +1,105 @@
+# Micro-batching for Prompt Embeddings
+import asyncio
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+class EmbeddingBatcher:
+    """
+    Collects concurrent embedding requests for up to `max_wait_ms` or
+    `max_batch_size` texts, runs them as one batched forward pass in a
+    worker thread, and resolves each caller's future with its own row.
+
+    The event loop only queues and awaits, so a slow forward pass no longer
+    blocks other requests.
+    """
+
+    def __init__(self, embed_batch_fn, max_batch_size: int = 16, max_wait_ms: float = 5.0):
+        self.embed_batch_fn = embed_batch_fn  # list[str] -> array (len, dim)
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+
+        self._queue = None
+        self._worker = None
+        self._executor = None
+
+        self.num_batches = 0
+        self.num_items = 0
+        self.batch_sizes = Counter()
+        self.total_wait_seconds = 0.0
+        self.total_run_seconds = 0.0
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        # A single inference thread; torch already parallelizes inside a forward pass
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed")
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._worker = self._executor = None
+
+    async def embed(self, text):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        # Block for the first item, then gather more until the batch is full or the wait runs out
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            texts = [text for text, _, _ in batch]
+            started = time.perf_counter()
+            try:
+                embeddings = await loop.run_in_executor(self._executor, self.embed_batch_fn, texts)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+
+            for i, (_, future, enqueued) in enumerate(batch):
+                self.total_wait_seconds += started - enqueued
+                if not future.done():  # the caller may have gone away
+                    future.set_result(embeddings[i])
+
+            self.num_batches += 1
+            self.num_items += len(batch)
+            self.batch_sizes[len(batch)] += 1
+            self.total_run_seconds += finished - started
+
+    def stats(self):
+        return {
+            "queue_depth": 0 if self._queue is None else self._queue.qsize(),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "num_batches": self.num_batches,
+            "num_items": self.num_items,
+            "mean_batch_size": self.num_items / self.num_batches if self.num_batches else 0.0,
+            "batch_size_counts": dict(sorted(self.batch_sizes.items())),
+            "mean_queue_wait_ms": 1000 * self.total_wait_seconds / self.num_items if self.num_items else 0.0,
+            "mean_batch_run_ms": 1000 * self.total_run_seconds / self.num_batches if self.num_batches else 0.0,
+        }
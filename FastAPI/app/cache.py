@@ -0,0 +1,130 @@
+# Prompt Embedding / Search Result Cache
+import asyncio
+import hashlib
+import os
+import threading
+from collections import Counter, OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+
+def normalize_prompt(prompt: str):
+    # The model is uncased, so case and spacing do not change the embedding
+    return " ".join(prompt.lower().split())
+
+
+class TwoLevelCache:
+    """
+    Bounded in-process LRU in front of an optional on-disk cache of numpy
+    arrays. Keys are tuples whose first item is a namespace, e.g.
+
+        ("embedding", model_id, prompt)
+        ("results", model_id, index_version, prompt, k)
+
+    Including the index version in result keys means entries computed
+    against an old index are never served once the index changes.
+    Concurrent misses for the same key share a single computation; if the
+    request running it is cancelled, a waiting request takes over.
+
+    The in-memory LRU is guarded by a lock, as `clear` is also called from
+    worker threads (index rebuilds, catalog reloads).
+    """
+
+    def __init__(self, max_items: int = 1024, disk_dir=None):
+        self.max_items = max_items
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.counters = Counter()
+
+    def _path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return self.disk_dir / key[0] / f"{digest}.npy"
+
+    def get(self, key):
+        namespace = key[0]
+        with self._lock:
+            value = self._lru.get(key)
+            if value is not None:
+                self._lru.move_to_end(key)
+                self.counters[f"{namespace}_memory_hits"] += 1
+                return value
+        if self.disk_dir is not None:
+            path = self._path(key)
+            if path.exists():
+                value = np.load(path)
+                self._put_memory(key, value)
+                self.counters[f"{namespace}_disk_hits"] += 1
+                return value
+        self.counters[f"{namespace}_misses"] += 1
+        return None
+
+    def _put_memory(self, key, value):
+        with self._lock:
+            self._lru[key] = value
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_items:
+                self._lru.popitem(last=False)
+
+    def put(self, key, value):
+        self._put_memory(key, value)
+        if self.disk_dir is not None:
+            path = self._path(key)
+            path.parent.mkdir(exist_ok=True)
+            tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, "wb") as f:
+                np.save(f, value)
+            os.replace(tmp_path, path)
+
+    async def get_or_compute(self, key, compute):
+        """Return the cached value for `key`, or await `compute()` once and cache it."""
+        if key in self._inflight:
+            self.counters[f"{key[0]}_coalesced"] += 1
+            future = self._inflight[key]
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise  # this request was cancelled
+                # The request computing it was cancelled: compute it here instead
+                return await self.get_or_compute(key, compute)
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # waiters re-raise it; don't warn if there are none
+            raise
+        else:
+            self.put(key, value)
+            future.set_result(value)
+        finally:
+            del self._inflight[key]
+            if not future.done():
+                # compute() was cancelled (client disconnect, shutdown): release the waiters
+                future.cancel()
+        return value
+
+    def clear(self, namespace=None):
+        """Drop in-memory entries, all of them or one namespace's."""
+        with self._lock:
+            for key in [key for key in self._lru if namespace is None or key[0] == namespace]:
+                del self._lru[key]
+
+    def stats(self):
+        return {
+            "memory_items": len(self._lru),
+            "max_items": self.max_items,
+            "disk_dir": None if self.disk_dir is None else str(self.disk_dir),
+            "inflight": len(self._inflight),
+            **self.counters,
+        }
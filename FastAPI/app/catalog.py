@@ -0,0 +1,53 @@
+# Display Catalog for Recommendation Responses
+import numpy as np
+
+try:
+    import orjson
+
+    def dumps(obj):
+        return orjson.dumps(obj)
+except ImportError:  # orjson is optional; fall back to the standard library
+    import json
+
+    def dumps(obj):
+        return json.dumps(obj, separators=(',', ':')).encode()
+
+DISPLAY_COLUMNS = ["FILE", "TITLE", "AUTHOR"]
+
+
+class DisplayCatalog:
+    """
+    The fields shown for a recommendation (FILE, TITLE, AUTHOR), kept as
+    arrays row-aligned with the vector store, plus each row's `details`
+    object serialized to JSON once up front.
+
+    A response is then assembled from the fragments of the selected rows,
+    without building per-row dicts or going through pandas.
+    """
+
+    def __init__(self, metadata):
+        columns = {
+            col: (metadata[col].fillna("").astype(str).to_numpy(dtype=object) if col in metadata else np.full(len(metadata), "", dtype=object))
+            for col in DISPLAY_COLUMNS
+        }
+        self.files = columns["FILE"]
+        self.titles = columns["TITLE"]
+        self.authors = columns["AUTHOR"]
+        self.fragments = [
+            dumps({"FILE": file, "TITLE": title, "AUTHOR": author})
+            for file, title, author in zip(self.files, self.titles, self.authors)
+        ]
+
+    def __len__(self):
+        return len(self.fragments)
+
+    def render(self, rows):
+        """JSON array of {"recommendation": i, "details": {...}} for the given rows."""
+        items = [
+            b'{"recommendation":%d,"details":%s}' % (i, self.fragments[row])
+            for i, row in enumerate((row for row in rows if row >= 0), 1)  # FAISS pads missing hits with -1
+        ]
+        return b'[' + b','.join(items) + b']'
+
+    def memory_bytes(self):
+        return int(sum(len(fragment) for fragment in self.fragments))
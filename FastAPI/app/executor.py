@@ -0,0 +1,109 @@
+# Execution Layer for CPU-bound Endpoint Work
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from fastapi import HTTPException
+
+
+class WorkPool:
+    """
+    Bounded thread pool for pandas/torch/FAISS work, so `async def`
+    endpoints never run it on the event loop.
+
+    Each endpoint name gets its own concurrency limit. Work that would make
+    an endpoint's backlog exceed `max_queue` is rejected with a 503 instead of
+    queueing without bound, so tail latency stays predictable under load.
+    """
+
+    def __init__(self, max_workers: int = 4, max_queue: int = 64, limits=None, history: int = 1024):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.limits = dict(limits or {})
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="work")
+        self._semaphores = {}
+        self._waiting = defaultdict(int)
+        self._running = defaultdict(int)
+
+        self.counters = defaultdict(lambda: defaultdict(int))
+        self.queue_seconds = defaultdict(lambda: deque(maxlen=history))
+        self.run_seconds = defaultdict(lambda: deque(maxlen=history))
+
+    def _semaphore(self, name):
+        if name not in self._semaphores:
+            self._semaphores[name] = asyncio.Semaphore(self.limits.get(name, self.max_workers))
+        return self._semaphores[name]
+
+    @asynccontextmanager
+    async def admit(self, name, record_queue: bool = True):
+        """
+        Hold one of `name`'s concurrency slots for the duration of the block.
+        Use directly for work that already runs elsewhere (e.g. the embedding
+        batcher); `run` uses it for work sent to the pool.
+        """
+        counters = self.counters[name]
+        if self._waiting[name] >= self.max_queue:
+            counters["shed"] += 1
+            raise HTTPException(status_code=503, detail=f"Server busy ({name}), try again shortly", headers={"Retry-After": "1"})
+
+        counters["submitted"] += 1
+        enqueued = time.perf_counter()
+        semaphore = self._semaphore(name)
+        self._waiting[name] += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self._waiting[name] -= 1
+
+        started = time.perf_counter()
+        if record_queue:
+            self.queue_seconds[name].append(started - enqueued)
+        self._running[name] += 1
+        try:
+            yield enqueued
+            counters["completed"] += 1
+        finally:
+            self._running[name] -= 1
+            semaphore.release()
+            self.run_seconds[name].append(time.perf_counter() - started)
+
+    async def run(self, name, fn, *args, **kwargs):
+        """Run `fn(*args, **kwargs)` in the pool under the limit for `name`."""
+        async with self.admit(name, record_queue=False) as enqueued:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._timed, name, enqueued, fn, args, kwargs
+            )
+
+    def _timed(self, name, enqueued, fn, args, kwargs):
+        # Queue time runs until a worker thread actually picks the job up
+        self.queue_seconds[name].append(time.perf_counter() - enqueued)
+        return fn(*args, **kwargs)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def stats(self):
+        def summary(values):
+            if not values:
+                return {"mean_ms": 0.0, "p95_ms": 0.0}
+            values_ms = 1000 * np.array(values)
+            return {"mean_ms": round(float(values_ms.mean()), 3), "p95_ms": round(float(np.percentile(values_ms, 95)), 3)}
+
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "endpoints": {
+                name: {
+                    "limit": self.limits.get(name, self.max_workers),
+                    "waiting": self._waiting[name],
+                    "running": self._running[name],
+                    **counters,
+                    "queue_time": summary(self.queue_seconds[name]),
+                    "run_time": summary(self.run_seconds[name]),
+                }
+                for name, counters in self.counters.items()
+            },
+        }
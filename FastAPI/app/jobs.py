@@ -0,0 +1,208 @@
+# Background Jobs
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from vector_store import VectorStore
+
+CHECKPOINT_FILE = 'checkpoint.json'
+
+
+class EmbeddingJob:
+    """
+    Embeds every catalog row whose id is missing from a VectorStore.
+
+    Texts are sorted by length and embedded in batches, so each padded batch
+    wastes little compute. Finished vectors are written to shards in
+    `work_dir` and recorded in a checkpoint; a killed run started again
+    skips everything already in a shard. When all rows are done the shards
+    are appended to the store and `work_dir` is removed. Jobs for the same
+    store, in this or another worker process, take turns on a lock file
+    next to `work_dir`.
+    """
+
+    def __init__(self, df, embed_batch_fn, store_dir, text_column="analysis", id_column="ID",
+                 batch_size: int = 16, shard_size: int = 512, length_fn=len, dim: int = 1024, store_meta=None):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.df = df
+        self.embed_batch_fn = embed_batch_fn  # list[str] -> array (len, dim)
+        self.store_dir = Path(store_dir)
+        self.work_dir = self.store_dir.parent / f"{self.store_dir.name}.job"
+        self.lock_path = self.store_dir.parent / f"{self.store_dir.name}.job.lock"
+        self.text_column = text_column
+        self.id_column = id_column
+        self.batch_size = batch_size
+        self.shard_size = shard_size
+        self.length_fn = length_fn
+        self.dim = dim
+        self.store_meta = store_meta or {}
+
+        self.status = "pending"
+        self.error = None
+        self.total = 0
+        self.resumed = 0  # rows recovered from shards of an earlier run
+        self.done = 0
+        self.started_at = None
+        self.finished_at = None
+
+    # Checkpoint
+    @property
+    def checkpoint_path(self):
+        return self.work_dir / CHECKPOINT_FILE
+
+    def _read_checkpoint(self):
+        if not self.checkpoint_path.exists():
+            return []
+        with open(self.checkpoint_path) as f:
+            return json.load(f)["shards"]
+
+    def _write_shard(self, shards, ids, vectors):
+        name = f"part-{len(shards):05d}"
+        for suffix, array in [(".ids.npy", np.asarray(ids, dtype='int64')), (".npy", np.asarray(vectors, dtype='float32'))]:
+            tmp_path = self.work_dir / f"{name}{suffix}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp_path, self.work_dir / f"{name}{suffix}")
+        shards.append(name)
+        # The checkpoint only ever lists shards that are fully on disk
+        tmp_path = self.checkpoint_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({"shards": shards}, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _load_shard(self, name):
+        return np.load(self.work_dir / f"{name}.ids.npy"), np.load(self.work_dir / f"{name}.npy", mmap_mode='r')
+
+    # Running
+    def run(self):
+        self.status = "running"
+        self.started_at = time.time()
+        try:
+            self._run()
+        except Exception as e:
+            self.status = "failed"
+            self.error = repr(e)
+            raise
+        else:
+            self.status = "completed"
+        finally:
+            self.finished_at = time.time()
+
+    def _run(self):
+        # torch's thread count is process-wide and shared with the request-path model:
+        # use every core for the job, then give the previous setting back
+        num_threads = torch.get_num_threads()
+        torch.set_num_threads(os.cpu_count() or 1)
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            with open(self.lock_path, "w") as lock_file:
+                # A later job finds the rows an earlier one added and skips them
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._embed_and_merge()
+        finally:
+            torch.set_num_threads(num_threads)
+
+    def _embed_and_merge(self):
+        store = VectorStore(self.store_dir)
+        if store.exists():
+            store.open()
+        else:
+            store = VectorStore.create(self.store_dir, self.dim, **self.store_meta)
+
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        shards = self._read_checkpoint()
+        shard_ids = [self._load_shard(name)[0] for name in shards]
+        finished = set(store.id_to_row).union(*map(set, shard_ids))
+
+        todo = self.df[~self.df[self.id_column].isin(finished)]
+        texts = todo[self.text_column].fillna("").astype(str).tolist()
+        ids = todo[self.id_column].to_numpy()
+        self.resumed = int(sum(len(x) for x in shard_ids))
+        self.total = len(texts)
+
+        # Similar lengths in one batch keep padding small
+        order = np.argsort([self.length_fn(text) for text in texts], kind='stable')
+
+        buffer_ids, buffer_vectors = [], []
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            buffer_vectors.append(self.embed_batch_fn([texts[i] for i in batch]))
+            buffer_ids.append(ids[batch])
+            self.done += len(batch)
+            if sum(len(x) for x in buffer_ids) >= self.shard_size:
+                self._write_shard(shards, np.concatenate(buffer_ids), np.concatenate(buffer_vectors))
+                buffer_ids, buffer_vectors = [], []
+        if buffer_ids:
+            self._write_shard(shards, np.concatenate(buffer_ids), np.concatenate(buffer_vectors))
+
+        # Merge; ids already in the store (from an interrupted merge) are skipped
+        for name in shards:
+            shard_ids, shard_vectors = self._load_shard(name)
+            new = np.array([id_ not in store for id_ in shard_ids], dtype=bool)
+            store.append(shard_ids[new], shard_vectors[new])
+        shutil.rmtree(self.work_dir)
+
+    def progress(self):
+        elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0.0
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "error": self.error,
+            "total": self.total,
+            "done": self.done,
+            "resumed": self.resumed,
+            "fraction": self.done / self.total if self.total else float(self.status == "completed"),
+            "elapsed_seconds": round(elapsed, 3),
+            "rows_per_second": round(self.done / elapsed, 3) if elapsed else 0.0,
+        }
+
+
+class JobManager:
+    """Runs jobs in background threads and keeps them for progress lookups."""
+
+    def __init__(self):
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+    def _start(self, job, on_success):
+        def target():
+            try:
+                job.run()
+            except Exception:
+                return  # recorded in job.error
+            if on_success is not None:
+                on_success()
+
+        self.jobs[job.job_id] = job
+        job.status = "queued"
+        threading.Thread(target=target, name=f"job-{job.job_id}", daemon=True).start()
+        return job
+
+    def _running(self, job_type):
+        for job in self.jobs.values():
+            if isinstance(job, job_type) and job.status in ("queued", "running"):
+                return job
+        return None
+
+    def submit(self, job, on_success=None):
+        with self._lock:
+            return self._start(job, on_success)
+
+    def submit_unless_running(self, job_type, create, on_success=None):
+        """
+        The queued or running job of `job_type`, or a new one from `create()`
+        started in the background. The check and the start are atomic.
+        """
+        with self._lock:
+            return self._running(job_type) or self._start(create(), on_success)
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
@@ -1,19 +1,117 @@
-from fastapi import FastAPI, HTTPException
-from typing import List
+from fastapi import FastAPI, HTTPException, Query, Response
+from contextlib import asynccontextmanager
+from typing import List, Optional
 from pydantic import BaseModel
-from models import allProfileQuestionModel, allProfileResponseModel
+from models import allProfileQuestionModel, allProfileResponseModel, searchBatchModel, recommendClickModel
 from modules import *
+from registry import ArtifactRegistry
+from batcher import EmbeddingBatcher
+from cache import TwoLevelCache, normalize_prompt
+from jobs import EmbeddingJob, JobManager
+from ann_index import evaluate_index
+from executor import WorkPool
+from question_pool import QuestionPool
+from search_service import SearchService
+from recommend_service import RecommendService
+import json
 from pathlib import Path
 
 # Get CSV file path
 current_dir = Path(__file__).parent
-csv_path = current_dir.parent / 'data' / 'art_metadata_embedding.csv'
-df = pd.read_csv(csv_path)
-
-user_data_path = current_dir.parent / 'data' / 'user_data.csv'
-
-
-app = FastAPI()
+csv_path = current_dir.parent / 'data' / 'art_metadata.csv'
+
+# Model, index and catalog shared by all requests
+registry = ArtifactRegistry()
+rng = np.random.default_rng()
+
+# Prompt embeddings are computed in small batches off the event loop
+batcher = EmbeddingBatcher(
+    lambda texts: get_bert_embeddings(texts, registry.tokenizer, registry.model),
+    max_batch_size=int(os.environ.get("EMBED_MAX_BATCH_SIZE", 16)),
+    max_wait_ms=float(os.environ.get("EMBED_MAX_WAIT_MS", 5)),
+)
+
+# e5 + SigLIP text search over the paintings catalog (Search/search.py);
+# concurrent /search calls are answered as one batch per model and index
+search_service = SearchService()
+search_batcher = EmbeddingBatcher(
+    search_service.search_many,
+    max_batch_size=int(os.environ.get("SEARCH_MAX_BATCH_SIZE", 8)),
+    max_wait_ms=float(os.environ.get("SEARCH_MAX_WAIT_MS", 5)),
+)
+
+# Channel-mixing recommender (Recommend/recommend.py): the catalog and indexes are
+# loaded once and shared; each user only has a small session in an LRU + TTL store
+recommend_service = RecommendService()
+
+# CPU-bound request work (pandas, FAISS, SQLite) runs here, never on the event loop.
+# Each endpoint gets its own concurrency limit; past WORK_QUEUE_SIZE waiting calls it answers 503.
+pool_size = int(os.environ.get("WORK_POOL_SIZE", os.cpu_count() or 4))
+pool = WorkPool(
+    max_workers=pool_size,
+    max_queue=int(os.environ.get("WORK_QUEUE_SIZE", 64)),
+    limits={
+        "responses": 2,
+        "profile": pool_size,
+        "search": pool_size,
+        "embed": 4 * batcher.max_batch_size,
+        "text_search": 4 * search_batcher.max_batch_size,  # GET /search, admitted into the micro-batcher
+        "search_batch": int(os.environ.get("SEARCH_BATCH_CONCURRENCY", 1)),  # POST /search_batch, up to 256 queries per call
+        "recommend": pool_size,
+    },
+)
+
+# Background jobs such as catalog embedding
+jobs = JobManager()
+
+# Prompt embeddings and top-k results; set PROMPT_CACHE_DIR to also keep them on disk
+prompt_cache = TwoLevelCache(
+    max_items=int(os.environ.get("PROMPT_CACHE_SIZE", 4096)),
+    disk_dir=os.environ.get("PROMPT_CACHE_DIR"),
+)
+
+
+# Ready-made questionnaires for /questions, built from the registry's catalog
+question_pool = None
+
+
+def start_question_pool():
+    global question_pool
+    old_pool = question_pool
+    question_pool = QuestionPool(registry.metadata['ID'], registry.metadata['TITLE'], registry.clusters)
+    question_pool.start()
+    if old_pool is not None:
+        old_pool.stop()
+
+
+def reload_catalog():
+    registry.load_catalog()
+    # Rebuilds the index when the store has rows it does not cover yet
+    registry.load_index()
+    prompt_cache.clear("results")
+    registry.load_clusters()
+    start_question_pool()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    registry.load()
+    start_question_pool()
+    search_service.load()
+    recommend_service.load()
+    await batcher.start()
+    await search_batcher.start()
+    yield
+    await search_batcher.stop()
+    await batcher.stop()
+    search_service.close()
+    recommend_service.close()
+    question_pool.stop()
+    pool.shutdown()
+    registry.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 @app.get("/questions", response_model=allProfileQuestionModel)
 async def get_questions():
@@ -26,13 +124,14 @@ async def get_questions():
             image_title: str
 
     """
-    allQuestions = create_all_profile_questions()
+    allQuestions = question_pool.get()
     return allQuestions
 
 @app.post("/responses")
-async def store_responses(user_responses: allProfileResponseModel):
+async def store_responses(user_responses: allProfileResponseModel, reset: bool = False):
     """
     Store user responses for the questionnaire.
+    The chosen artworks are added to the user's existing profile unless `reset` is set.
     """
 
     def get_response_choice_ids(responses: allProfileResponseModel):
@@ -41,24 +140,13 @@ async def store_responses(user_responses: allProfileResponseModel):
     id_list = get_response_choice_ids(user_responses)
 
     # Find rows corresponding to the selected IDs
-    selected_rows = df[df['ID'].isin(id_list)]
-
-    # Assuming embeddings are stored as 'emb_0' to 'emb_1023'
-    embedding_columns = [f'emb_{i}' for i in range(1024)]
-    mean_embedding = selected_rows[embedding_columns].mean()
+    selected_ids = [id_ for id_ in id_list if id_ in registry.store]
+    if not selected_ids:
+        raise HTTPException(status_code=400, detail="None of the chosen artworks are in the catalog")
 
-    # Store the mean embedding in the user's profile
+    # Fold the choices into the user's running-mean profile
     user_name = user_responses.user_name or "guest_login"
-    user_data = pd.read_csv(user_data_path)
-
-    if user_name in user_data['username'].values:
-        user_data.loc[user_data['username'] == user_name, embedding_columns] = mean_embedding.values
-    else:
-        new_user_row = pd.DataFrame([[user_name] + [10] + mean_embedding.tolist()], columns=['username', 'viewed'] + embedding_columns)
-        user_data = pd.concat([user_data, new_user_row], ignore_index=True)
-
-
-    user_data.to_csv(user_data_path, index=False)
+    await pool.run("responses", lambda: registry.users.add_choices(user_name, registry.store.get(selected_ids), reset=reset))
 
     return {"message": f"User responses stored successfully for {user_name}."}
 
@@ -69,15 +157,96 @@ def test():
     return {"message": "Hello World"}
 
 
+@app.get("/artifacts")
+def get_artifacts():
+    """
+    Load times (seconds) and memory footprint (bytes) of the shared artifacts.
+    """
+    return {**registry.stats(), "search": search_service.stats(), "recommend": recommend_service.stats()}
+
+
+@app.get("/batcher_stats")
+def get_batcher_stats():
+    """
+    Queue depth and batch-size statistics of the prompt embedding and
+    text search batchers.
+    """
+    return {**batcher.stats(), "search": search_batcher.stats()}
+
+
+@app.get("/cache_stats")
+def get_cache_stats():
+    """
+    Hit/miss counters of the prompt embedding and search result cache.
+    """
+    return prompt_cache.stats()
+
+
+@app.get("/pool_stats")
+def get_pool_stats():
+    """
+    Per-endpoint concurrency, queue time and load-shedding counters of the work pool.
+    """
+    return pool.stats()
+
+
+@app.get("/session_stats")
+def get_session_stats():
+    """
+    Live recommendation sessions and hit / creation / expiry / eviction counters.
+    """
+    return recommend_service.sessions.stats()
+
+
+@app.get("/question_pool_stats")
+def get_question_pool_stats():
+    """
+    Ready-made questionnaires available and how many were served.
+    """
+    return question_pool.stats()
+
+
 @app.get("/create_embeddings")
 def create_embeddings():
-    process_dataframe(df)
-    return {"message": "Embeddings Generated"}
+    """
+    Start embedding catalog rows missing from the vector store in the background.
+    Poll /jobs/{job_id} for progress. When the job completes the catalog is
+    reloaded and the index rebuilt (same spec) to include the new rows.
+    """
+    job = jobs.submit_unless_running(
+        EmbeddingJob,
+        lambda: create_embedding_job(pd.read_csv(csv_path), registry.tokenizer, registry.model, store_dir=registry.store.directory),
+        on_success=reload_catalog,
+    )
+    return {"message": "Embedding job started", "job_id": job.job_id}
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return job.progress()
 
 @app.get("/create_index")
-def create_index():
-    create_faiss_index(df)
-    return {"message": "Index Created"}
+def create_index(spec: str = "Flat", train_size: int = 50000, search_params: str = "", k: int = 15):
+    """
+    Build and load a new index. `spec` is one of flat, ivf_flat, ivf_pq, hnsw,
+    sq8 or a FAISS index_factory string; `search_params` e.g. "nprobe=16".
+    Returns recall@k against exact search, p50/p99 query latency and index size.
+    """
+    try:
+        index = create_faiss_index(registry.store, faiss_index_path=str(registry.index_path), spec=spec, train_size=train_size, search_params=search_params or None)
+    except RuntimeError as e:
+        raise HTTPException(status_code=400, detail=f"Cannot build index '{spec}': {e}")
+    report = {"spec": spec, "search_params": search_params or None, **evaluate_index(index, registry.store.vectors, k=k)}
+    with open(registry.index_report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    registry.load_index()
+    # Results are keyed by index version; drop the ones that can no longer be hit
+    prompt_cache.clear("results")
+    return {"message": "Index Created", "report": report}
 
 
 @app.get("/get_recommendation_random", response_model=List[dict])
@@ -90,26 +259,15 @@ async def get_recommendation_random(n: int = 15):
     if n <= 0:
         raise HTTPException(status_code=400, detail="Number of recommendations must be positive")
 
-    # Check if the DataFrame has enough rows
-    if n > len(df):
-        raise HTTPException(status_code=400, detail=f"Cannot provide {n} recommendations. Only {len(df)} available.")
-
-    # Randomly select N rows from the DataFrame
-    recommendations = df.sample(n).to_dict(orient='records')
+    num_artworks = len(registry.display)
 
-    # Formatting the response
-    formatted_response = []
-    for idx, rec in enumerate(recommendations, 1):
-        formatted_response.append({
-            "recommendation": idx,
-            "details": {
-                "FILE": rec.get("FILE", ""),
-                "TITLE": rec.get("TITLE", ""),
-                "AUTHOR": rec.get("AUTHOR", "")
-            }
-        })
+    # Check if the catalog has enough rows
+    if n > num_artworks:
+        raise HTTPException(status_code=400, detail=f"Cannot provide {n} recommendations. Only {num_artworks} available.")
 
-    return formatted_response
+    # Randomly select N rows and answer with their pre-serialized details
+    rows = rng.choice(num_artworks, size=n, replace=False)
+    return Response(content=registry.display.render(rows), media_type="application/json")
 
 
 @app.get("/get_recommendation_by_profile", response_model=List[dict])
@@ -119,36 +277,18 @@ async def get_recommendation_by_profile(user_name: str, n: int = 15):
     Each recommended item has a nested JSON with 'FILE', 'TITLE', and 'AUTHOR'.
     """
 
-    data_folder = Path(os.getcwd()).parent / "data" 
-
-    user_df = pd.read_csv(data_folder/"user_data.csv")  # assuming user data is in 'user_data.csv'
-    embeddings_df = pd.read_csv(data_folder/"art_metadata_embedding.csv")  # assuming embeddings are in 'embeddings.csv'
-
     # Retrieve user embedding
-    if user_name not in user_df['username'].values:
+    profile = await pool.run("profile", registry.users.get, user_name)
+    if profile is None:
         raise HTTPException(status_code=404, detail=f"User '{user_name}' not found")
 
-    user_data = user_df[user_df['username'] == user_name].iloc[0]
-    user_embedding = np.array([user_data[f'emb_{i}'] for i in range(1024)], dtype=float)
+    viewed, user_embedding = profile
     
     # Retrieve similar items using FAISS
-    faiss_index = faiss.read_index("embedding_model/faiss_index.pickle")
-    similar_indices = retrieve_similar_items(user_embedding, faiss_index, n)
-    similar_rows = get_dataframe_rows(embeddings_df, similar_indices)
+    similar_indices = await pool.run("search", retrieve_similar_items, user_embedding, registry.index, n)
 
-    # Formatting the response
-    formatted_response = []
-    for idx, rec in enumerate(similar_rows.to_dict(orient='records'), 1):
-        formatted_response.append({
-            "recommendation": idx,
-            "details": {
-                "FILE": rec.get("FILE", ""),
-                "TITLE": rec.get("TITLE", ""),
-                "AUTHOR": rec.get("AUTHOR", "")
-            }
-        })
-
-    return formatted_response
+    # Assemble the response from the rows' pre-serialized details
+    return Response(content=registry.display.render(similar_indices), media_type="application/json")
 
 
 @app.get("/get_recommendation_by_prompt", response_model=List[dict])
@@ -158,31 +298,125 @@ async def get_recommendation_by_prompt(prompt: str, n: int = 15):
     Each recommended item has a nested JSON with 'FILE', 'TITLE', and 'AUTHOR'.
     """
 
-    # Load user data and embeddings DataFrame
-    data_folder = Path(os.getcwd()).parent / "data" 
+    prompt = normalize_prompt(prompt)
+
+    async def search():
+        async def embed():
+            async with pool.admit("embed"):
+                return await batcher.embed(prompt)
+
+        prompt_embedding = await prompt_cache.get_or_compute(("embedding", registry.model_id, prompt), embed)
+        # Retrieve similar items using FAISS
+        return await pool.run("search", retrieve_similar_items, prompt_embedding, registry.index, n)
+
+    similar_indices = await prompt_cache.get_or_compute(
+        ("results", registry.model_id, registry.index_version, prompt, n), search
+    )
+
+    # Assemble the response from the rows' pre-serialized details
+    return Response(content=registry.display.render(similar_indices), media_type="application/json")
+
+
+@app.get("/search")
+async def search_artworks(
+    query: str,
+    n: int = 25,
+    k: int = 500,
+    method: str = "minmax",
+    artist: Optional[List[str]] = Query(None),
+    source: Optional[List[str]] = Query(None),
+    medium: Optional[List[str]] = Query(None),
+    movement: Optional[List[str]] = Query(None),
+    tags: Optional[List[str]] = Query(None),
+    year_min: Optional[int] = None,
+    year_max: Optional[int] = None,
+):
+    """
+    Hybrid text search: e5 passage search and SigLIP image search run
+    concurrently and their top-k lists are fused (`method`: rrf, minmax,
+    zscore or sum). Returns the top n paintings with scores and per-stage
+    timings (ms).
+
+    Optional filters restrict the search itself to matching paintings:
+    artist, source, medium and movement match any given value (substring,
+    case-insensitive), all given tags must be present, and year_min /
+    year_max bound the creation year.
+    """
+    filters = dict(artist=artist, source=source, medium=medium, movement=movement, tags=tags, year_min=year_min, year_max=year_max)
+    filter_key = check_search_request(n, k, method, filters)
+    async with pool.admit("text_search"):
+        return await search_batcher.embed((query, n, k, method, filter_key))
 
-    embeddings_df = pd.read_csv(data_folder/"art_metadata_embedding.csv")  # assuming embeddings are in 'embeddings.csv'
 
-    prompt_embedding = get_bert_embedding(prompt)
+@app.post("/search_batch")
+async def search_artworks_batch(request: searchBatchModel):
+    """
+    Bulk text search for offline curation and evaluation: all queries are
+    encoded together and each index is searched once for the whole list.
+    Returns one result list per query and the batch timings (ms).
+    """
+    filters = request.filters.model_dump() if request.filters else {}
+    filter_key = check_search_request(request.n, request.k, request.method, filters)
+    return await pool.run(
+        "search_batch", search_service.search_batch, request.queries,
+        n=request.n, k=request.k, method=request.method, filters=dict(filter_key or ()),
+    )
 
-    # Retrieve similar items using FAISS
-    faiss_index = faiss.read_index("embedding_model/faiss_index.pickle")
-    similar_indices = retrieve_similar_items(prompt_embedding, faiss_index, n)
-    similar_rows = get_dataframe_rows(embeddings_df, similar_indices)
-
-    # Formatting the response
-    formatted_response = []
-    for idx, rec in enumerate(similar_rows.to_dict(orient='records'), 1):
-        formatted_response.append({
-            "recommendation": idx,
-            "details": {
-                "FILE": rec.get("FILE", ""),
-                "TITLE": rec.get("TITLE", ""),
-                "AUTHOR": rec.get("AUTHOR", "")
-            }
-        })
-
-    return formatted_response
+
+@app.post("/recommend/{session_id}/clicks")
+async def record_clicks(session_id: str, request: recommendClickModel):
+    """
+    Record artworks clicked in a session (a new session is started for an
+    unknown or expired id). `timestamps` default to now.
+    """
+    check_recommend_request()
+    if request.timestamps is not None and len(request.timestamps) != len(request.object_ids):
+        raise HTTPException(status_code=400, detail="timestamps must match object_ids")
+    try:
+        return await pool.run("recommend", recommend_service.click, session_id, request.object_ids, request.timestamps)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/recommend/{session_id}")
+async def recommend_page(session_id: str):
+    """
+    Next recommendation page of a session: artworks mixed from the image
+    similarity, same artist, common tags and random channels, each with the
+    channel it came from, plus the page timings (ms) and per-channel fill.
+    """
+    check_recommend_request()
+    return await pool.run("recommend", recommend_service.recommend, session_id)
+
+
+@app.delete("/recommend/{session_id}")
+def end_session(session_id: str):
+    """
+    Drop a session's state.
+    """
+    if not recommend_service.end(session_id):
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found")
+    return {"message": f"Session {session_id} ended."}
+
+
+def check_recommend_request():
+    if not recommend_service.available:
+        raise HTTPException(status_code=503, detail=f"Recommendation service not available: {recommend_service.error}")
+
+
+def check_search_request(n, k, method, filters):
+    """Validate a search request; returns the hashable form of its filters."""
+    if not search_service.available:
+        raise HTTPException(status_code=503, detail=f"Search service not available: {search_service.error}")
+    if n <= 0 or k <= 0:
+        raise HTTPException(status_code=400, detail="n and k must be positive")
+    if method not in search_service.fusion_methods:
+        raise HTTPException(status_code=400, detail=f"method must be one of {', '.join(search_service.fusion_methods)}")
+    filters = {field: value for field, value in filters.items() if value is not None}
+    try:
+        return search_service.filter_key(filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 def retrieve_similar_items(embedding, faiss_index, top_k=5):
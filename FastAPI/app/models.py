@@ -20,4 +20,26 @@ class profileResponseModel(BaseModel):
 
 class allProfileResponseModel(BaseModel):
     responses: List[profileResponseModel]
-    user_name: Optional[str] = None
\ No newline at end of file
+    user_name: Optional[str] = None
+
+# Text Search Models
+class searchFilterModel(BaseModel):
+    artist: Optional[List[str]] = None
+    source: Optional[List[str]] = None
+    medium: Optional[List[str]] = None
+    movement: Optional[List[str]] = None
+    tags: Optional[List[str]] = None
+    year_min: Optional[int] = None
+    year_max: Optional[int] = None
+
+class searchBatchModel(BaseModel):
+    queries: conlist(str, min_length=1, max_length=256)
+    n: int = 25
+    k: int = 500
+    method: str = "minmax"
+    filters: Optional[searchFilterModel] = None
+
+# Recommendation Session Models
+class recommendClickModel(BaseModel):
+    object_ids: conlist(int, min_length=1, max_length=256)
+    timestamps: Optional[List[str]] = None
@@ -37,10 +37,14 @@ import torch
 from transformers import BertTokenizer, BertModel
 import faiss
 import numpy as np
-import tqdm
 import os
+from vector_store import VectorStore
+from jobs import EmbeddingJob
+from ann_index import build_index
 
-def get_bert_embedding(text, model_name: str = "bert-large-uncased", model_dir = "./embedding_model",max_length: int = 512):
+vector_dir = current_dir.parent / 'data' / 'artwork_vectors'
+
+def load_bert_model(model_name: str = "bert-large-uncased", model_dir = "./embedding_model"):
     if not os.path.exists(model_dir):
         os.makedirs(model_dir)  # Create the directory if it doesn't exist
         # Download and save the tokenizer and model
@@ -52,52 +56,85 @@ def get_bert_embedding(text, model_name: str = "bert-large-uncased", model_dir =
         # Load the tokenizer and model from the local directory
         tokenizer = BertTokenizer.from_pretrained(model_dir)
         model = BertModel.from_pretrained(model_dir)
-    
-    chunks = [text[i:i+max_length] for i in range(0, len(text), max_length)]
-    embedding = []
-    for chunk in chunks:
-        input_ids = tokenizer.encode(chunk, add_special_tokens=True, return_tensors='pt')
+    model.eval()
+    return tokenizer, model
+
+def get_bert_embedding(text, model_name: str = "bert-large-uncased", model_dir = "./embedding_model",max_length: int = 512, tokenizer=None, model=None):
+    # Callers holding a preloaded tokenizer/model (see registry.py) pass them in
+    if tokenizer is None or model is None:
+        tokenizer, model = load_bert_model(model_name, model_dir)
+    return get_bert_embeddings([text], tokenizer, model, max_length=max_length)[0]
+
+def chunk_token_windows(token_ids, max_length: int = 512, overlap: int = 64):
+    # Split one document's token ids into windows that fit the model after [CLS]/[SEP] are added
+    window = max_length - 2
+    step = window - overlap
+    if len(token_ids) <= window:
+        return [token_ids]
+    return [token_ids[start:start+window] for start in range(0, len(token_ids) - overlap, step)]
+
+def get_bert_embeddings(texts, tokenizer, model, max_length: int = 512, overlap: int = 64, max_windows: int = 64):
+    # Token-level sliding windows of all texts, run as padded batches of up to max_windows windows
+    token_ids = tokenizer([str(text) for text in texts], add_special_tokens=False, return_attention_mask=False, verbose=False)['input_ids']
+    windows, owners = [], []
+    for i, ids in enumerate(token_ids):
+        for chunk in chunk_token_windows(ids, max_length, overlap):
+            windows.append([tokenizer.cls_token_id] + chunk + [tokenizer.sep_token_id])
+            owners.append(i)
+
+    # Longest windows first, so each batch holds similar lengths
+    order = sorted(range(len(windows)), key=lambda w: -len(windows[w]))
+    window_embeddings = np.empty((len(windows), model.config.hidden_size), dtype='float32')
+    for start in range(0, len(order), max_windows):
+        batch = order[start:start+max_windows]
+        length = len(windows[batch[0]])
+        input_ids = torch.full((len(batch), length), tokenizer.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch), length), dtype=torch.long)
+        for row, w in enumerate(batch):
+            input_ids[row, :len(windows[w])] = torch.tensor(windows[w])
+            attention_mask[row, :len(windows[w])] = 1
         with torch.no_grad():
-            outputs = model(input_ids)
-        embedding.append(outputs[0].mean(dim=1).squeeze().numpy())
-    # Return the average of the embeddings
-    return np.mean(embedding, axis=0)
-
-def process_dataframe(df, text_column="analysis", embedding_column_prefix="emb_", output_csv="data/art_metadata_embedding.csv"):
-    embedding_size = 1024  # Adjust based on your model's embedding size
-    embedding_columns = [f"{embedding_column_prefix}{i}" for i in range(embedding_size)]
-
-    # Load existing data or initialize DataFrame with embedding columns
-    if os.path.exists(output_csv) and os.path.getsize(output_csv) > 0:
-        existing_df = pd.read_csv(output_csv)
-    else:
-        # Create a DataFrame with additional embedding columns initialized as NaN
-        for col in embedding_columns:
-            df[col] = float('nan')
-        existing_df = df
-
-    # Identify rows with missing embeddings
-    missing_embeddings = existing_df[embedding_columns].isna().any(axis=1)
-
-    for idx in tqdm.tqdm(df.index):
-        if missing_embeddings[idx]:
-            text = df.loc[idx, text_column]
-            # Get the embedding for the text
-            embedding = get_bert_embedding(text)
-            # Update the row with the new embeddings
-            existing_df.loc[idx, embedding_columns] = list(embedding)
-            # Save the updated DataFrame to the CSV file
-            existing_df.to_csv(output_csv, index=False)
-
-
-def create_faiss_index(df, embedding_column_prefix="emb_", faiss_index_path="embedding_model/faiss_index.pickle"):
-    embedding_columns = [col for col in df.columns if col.startswith(embedding_column_prefix)]
-    embeddings = df[embedding_columns].to_numpy(dtype='float32')
-    dimension = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)
-    index.add(embeddings)
+            outputs = model(input_ids=input_ids, attention_mask=attention_mask)
+        # Mean over real tokens only, so padding does not change a window's embedding
+        mask = attention_mask.unsqueeze(-1).to(outputs[0].dtype)
+        window_embeddings[batch] = ((outputs[0] * mask).sum(dim=1) / mask.sum(dim=1)).numpy()
+
+    # Return the average of each text's window embeddings
+    owners = np.array(owners)
+    return np.stack([window_embeddings[owners == i].mean(axis=0) for i in range(len(texts))])
+
+def process_dataframe(df, text_column="analysis", id_column="ID", store_dir=vector_dir, tokenizer=None, model=None, batch_size: int = 16):
+    if tokenizer is None or model is None:
+        tokenizer, model = load_bert_model()
+    job = create_embedding_job(df, tokenizer, model, text_column=text_column, id_column=id_column, store_dir=store_dir, batch_size=batch_size)
+    job.run()
+    return VectorStore(store_dir).open()
+
+
+def create_embedding_job(df, tokenizer, model, text_column="analysis", id_column="ID", store_dir=vector_dir, batch_size: int = 16):
+    # Embed rows missing from the vector store in length-sorted batches; resumable (see jobs.py)
+    return EmbeddingJob(
+        df,
+        lambda texts: get_bert_embeddings(texts, tokenizer, model),
+        store_dir,
+        text_column=text_column,
+        id_column=id_column,
+        batch_size=batch_size,
+        length_fn=lambda text: len(tokenizer.tokenize(text)),
+        dim=model.config.hidden_size,
+        store_meta={"model": "bert-large-uncased"},
+    )
+
+
+def create_faiss_index(store, faiss_index_path="embedding_model/faiss_index.pickle", spec="Flat", train_size: int = 50000, search_params=None):
+    # Index rows follow the store rows, so store.ids maps search results back to artwork IDs
+    # spec: Flat, IVF-Flat, IVF-PQ, HNSW, SQ8 or any FAISS factory string (see ann_index.py)
+    index = build_index(store.vectors, spec=spec, train_size=train_size, search_params=search_params)
     if faiss_index_path:
-        faiss.write_index(index, faiss_index_path)
+        # Write a private temp file and rename it, so other workers never read a partial index
+        tmp_path = f"{faiss_index_path}.{os.getpid()}.tmp"
+        faiss.write_index(index, tmp_path)
+        os.replace(tmp_path, faiss_index_path)
     
     return index
 
@@ -0,0 +1,129 @@
+# Precomputed Profile Question Sets
+import threading
+from collections import deque
+
+import faiss
+import numpy as np
+
+from models import profileChoiceModel, profileQuestionModel, allProfileQuestionModel
+
+CLUSTERS_FILE = 'clusters.npy'
+
+
+def load_or_compute_clusters(store, n_clusters: int = 40, max_points_per_centroid: int = 256, seed: int = 0):
+    """
+    Style cluster of every row in `store`, computed once with k-means and
+    saved next to the vectors. Recomputed only when the store has grown.
+    """
+    path = store.directory / CLUSTERS_FILE
+    if path.exists():
+        clusters = np.load(path)
+        if len(clusters) == store.count:
+            return clusters
+
+    embeddings = np.ascontiguousarray(store.vectors, dtype='float32')
+    n_clusters = max(1, min(n_clusters, len(embeddings)))
+    kmeans = faiss.Kmeans(store.dim, n_clusters, niter=20, seed=seed, max_points_per_centroid=max_points_per_centroid)
+    kmeans.train(embeddings)
+    _, clusters = kmeans.index.search(embeddings, 1)
+    clusters = clusters[:, 0].astype('int32')
+
+    tmp_path = path.with_suffix('.tmp.npy')
+    np.save(tmp_path, clusters)
+    tmp_path.replace(path)
+    return clusters
+
+
+class QuestionPool:
+    """
+    Ready-made questionnaires, refilled by a background thread so
+    /questions only pops one from memory.
+
+    The catalog is kept as id/title arrays plus per-cluster row lists. Each
+    questionnaire draws its images from distinct style clusters (cycling
+    through them when there are fewer clusters than images), so every set
+    covers as many styles as possible.
+    """
+
+    def __init__(self, ids, titles, clusters, size: int = 64, n_questions: int = 10, n_choices: int = 4, seed=None):
+        self.ids = np.asarray(ids, dtype='int64')
+        self.titles = np.asarray(titles, dtype=object)
+        self.n_questions = n_questions
+        self.n_choices = n_choices
+        self.size = size
+        self.rng = np.random.default_rng(seed)
+
+        # Rows grouped by cluster: members[offsets[c]:offsets[c+1]] are cluster c's rows
+        clusters = np.asarray(clusters)
+        self.members = np.argsort(clusters, kind='stable')
+        self.cluster_ids, counts = np.unique(clusters, return_counts=True)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+        self._sets = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.served = 0
+        self.built_on_demand = 0
+
+    def build_set(self):
+        n_images = self.n_questions * self.n_choices
+        n_clusters = len(self.cluster_ids)
+        with self._lock:  # numpy Generators are not thread-safe
+            # Distinct clusters first; repeat the permutation only if there are too few
+            order = np.concatenate([self.rng.permutation(n_clusters) for _ in range(-(-n_images // n_clusters))])[:n_images]
+            picks = self.rng.random(n_images)
+        rows = self.members[self.offsets[order] + (picks * (self.offsets[order + 1] - self.offsets[order])).astype('int64')]
+
+        questions = []
+        for q_id in range(self.n_questions):
+            choices = [
+                profileChoiceModel(image_id=int(self.ids[row]), image_title=str(self.titles[row]))
+                for row in rows[q_id * self.n_choices:(q_id + 1) * self.n_choices]
+            ]
+            questions.append(profileQuestionModel(question_id=q_id, choices=choices))
+        return allProfileQuestionModel(questions=questions)
+
+    def get(self):
+        try:
+            question_set = self._sets.popleft()
+        except IndexError:
+            self.built_on_demand += 1
+            question_set = self.build_set()
+        self.served += 1
+        if len(self._sets) < self.size // 2:
+            self._wake.set()
+        return question_set
+
+    def fill(self):
+        while len(self._sets) < self.size and not self._stop.is_set():
+            self._sets.append(self.build_set())
+
+    def _refill_loop(self):
+        while not self._stop.is_set():
+            self.fill()
+            self._wake.wait()
+            self._wake.clear()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._refill_loop, name="question-pool", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+
+    def stats(self):
+        return {
+            "available": len(self._sets),
+            "size": self.size,
+            "served": self.served,
+            "built_on_demand": self.built_on_demand,
+            "num_artworks": len(self.ids),
+            "num_clusters": len(self.cluster_ids),
+        }
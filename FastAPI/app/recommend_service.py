@@ -0,0 +1,101 @@
+# Multi-User Channel Recommendation Service
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+from session_store import SessionStore
+
+current_dir = Path(__file__).parent
+RECOMMEND_DIR = current_dir.parent.parent / 'Recommend'
+RECOMMEND_DATA_DIR = current_dir.parent.parent / 'data'
+
+RESULT_COLUMNS = ["image_id", "title", "artist_display", "date_display"]
+NUM_SESSION_LOCKS = 64
+
+
+class RecommendService:
+    """
+    Serves Recommend/recommend.py's channel-mixing recommender to many
+    users at once: one RecommenderCatalog (metadata, DINO index, posting
+    lists) is loaded at startup and shared, and each user only has a
+    small Session in an LRU store with a TTL.
+
+    Requests for the same session are serialized by a striped lock, so a
+    click and a page request never update one session concurrently.
+    If the catalog cannot be loaded the service reports itself
+    unavailable instead of stopping the app.
+
+    RECOMMEND_MAX_SESSIONS and RECOMMEND_SESSION_TTL (seconds) size the
+    session store.
+    """
+
+    def __init__(self, data_dir=None, max_sessions=None, ttl_seconds=None):
+        self.data_dir = Path(data_dir or os.environ.get("RECOMMEND_DATA_DIR", RECOMMEND_DATA_DIR))
+        self.sessions = SessionStore(
+            max_sessions=max_sessions or int(os.environ.get("RECOMMEND_MAX_SESSIONS", 10000)),
+            ttl_seconds=ttl_seconds or float(os.environ.get("RECOMMEND_SESSION_TTL", 1800)),
+        )
+        self.catalog = None
+        self.error = None
+        self.load_seconds = None
+        self._locks = [threading.Lock() for _ in range(NUM_SESSION_LOCKS)]
+
+    @property
+    def available(self):
+        return self.catalog is not None
+
+    def load(self):
+        start = time.perf_counter()
+        try:
+            if str(RECOMMEND_DIR) not in sys.path:
+                sys.path.append(str(RECOMMEND_DIR))
+            from recommend import DEFAULT_CONFIGS, RecommenderCatalog, get_metadata
+
+            metadata = get_metadata(str(self.data_dir))
+            self.catalog = RecommenderCatalog(metadata, DEFAULT_CONFIGS, data_dir=str(self.data_dir))
+        except (ImportError, OSError, RuntimeError, ValueError, KeyError) as e:
+            self.error = repr(e)
+        self.load_seconds = round(time.perf_counter() - start, 4)
+
+    def close(self):
+        self.sessions.clear()
+        self.catalog = None
+
+    def _lock(self, session_id):
+        return self._locks[hash(session_id) % NUM_SESSION_LOCKS]
+
+    def click(self, session_id, object_ids, timestamps=None):
+        """Record clicks for a session (created if new); raises ValueError for unknown object ids."""
+        with self._lock(session_id):
+            session = self.sessions.get_or_create(session_id, self.catalog.new_session)
+            self.catalog.add_clicks(session, object_ids, timestamps)
+            return {"session_id": session_id, "num_clicks": len(session.log_ids)}
+
+    def recommend(self, session_id):
+        """The session's next page, with each artwork's channel and the page stats (ms)."""
+        with self._lock(session_id):
+            session = self.sessions.get_or_create(session_id, self.catalog.new_session)
+            recs, rec_channels, stats = self.catalog.recommend(session)
+
+        metadata = self.catalog.metadata
+        columns = [col for col in RESULT_COLUMNS if col in metadata.columns]
+        result = metadata.loc[recs, columns].reset_index(names="object_id")
+        result["channel"] = rec_channels
+        return {
+            "session_id": session_id,
+            "results": result.astype(object).where(result.notna(), None).to_dict(orient="records"),
+            "stats": stats,
+        }
+
+    def end(self, session_id):
+        return self.sessions.delete(session_id)
+
+    def stats(self):
+        return {
+            "available": self.available,
+            "error": self.error,
+            "load_seconds": self.load_seconds,
+            **self.sessions.stats(),
+        }
@@ -0,0 +1,138 @@
+# Shared Artifacts
+import json
+import os
+import time
+from pathlib import Path
+
+import faiss
+import pandas as pd
+
+from modules import load_bert_model, create_faiss_index
+from vector_store import VectorStore
+from user_store import UserProfileStore
+from question_pool import load_or_compute_clusters
+from catalog import DisplayCatalog
+
+current_dir = Path(__file__).parent
+DATA_DIR = current_dir.parent / 'data'
+MODEL_DIR = current_dir / 'embedding_model'
+INDEX_PATH = MODEL_DIR / 'faiss_index.pickle'
+VECTOR_DIR = DATA_DIR / 'artwork_vectors'
+USER_VECTOR_DIR = DATA_DIR / 'user_vectors'
+
+
+class ArtifactRegistry:
+    """
+    Holds the artifacts every request needs: the BERT tokenizer and model,
+    the FAISS index and the artwork catalog.
+
+    `load()` is called once from the app lifespan, after which the endpoints
+    read the shared objects instead of loading them from disk per request.
+    """
+
+    def __init__(self, data_dir=DATA_DIR, model_dir=MODEL_DIR, index_path=INDEX_PATH, vector_dir=VECTOR_DIR, user_vector_dir=USER_VECTOR_DIR):
+        self.data_dir = Path(data_dir)
+        self.model_dir = Path(model_dir)
+        self.index_path = Path(index_path)
+
+        self.model_id = "bert-large-uncased"
+        self.tokenizer = None
+        self.model = None
+        self.index = None
+        self.index_version = None  # changes whenever a different index is loaded
+        self.store = VectorStore(vector_dir)
+        self.users = UserProfileStore(self.data_dir / 'users.sqlite', user_vector_dir)
+        self.metadata = None  # catalog without embeddings, row-aligned with the store
+        self.embeddings = None  # memory-mapped float32 (n, dim)
+        self.display = None  # response fields and pre-serialized JSON per row
+        self.clusters = None  # style cluster of each row, for questionnaire sampling
+
+        self.load_seconds = {}
+        self.memory_bytes = {}
+
+    @property
+    def catalog_csv(self):
+        # Old layout: metadata plus 1024 emb_* text columns, only read for migration
+        return self.data_dir / 'art_metadata_embedding.csv'
+
+    @property
+    def metadata_csv(self):
+        return self.data_dir / 'art_metadata.csv'
+
+    @property
+    def user_data_csv(self):
+        return self.data_dir / 'user_data.csv'
+
+    def load(self):
+        self._timed("model", self.load_model)
+        self._timed("catalog", self.load_catalog)
+        self._timed("index", self.load_index)
+        self._timed("clusters", self.load_clusters)
+        self._timed("users", self.load_users)
+
+    def close(self):
+        self.tokenizer = self.model = self.index = None
+        self.metadata = self.embeddings = self.display = None
+
+    def _timed(self, name, load_fn):
+        start = time.perf_counter()
+        load_fn()
+        self.load_seconds[name] = round(time.perf_counter() - start, 4)
+
+    def load_model(self):
+        self.tokenizer, self.model = load_bert_model(model_dir=str(self.model_dir))
+        self.memory_bytes["model"] = int(sum(p.numel() * p.element_size() for p in self.model.parameters()))
+
+    def load_catalog(self):
+        if not self.store.exists():
+            # One-off migration from the CSV layout
+            VectorStore.from_dataframe(self.store.directory, pd.read_csv(self.catalog_csv), model="bert-large-uncased")
+        self.store.open()
+        self.embeddings = self.store.vectors
+        metadata = pd.read_csv(self.metadata_csv)
+        self.metadata = metadata.set_index('ID').reindex(self.store.ids).rename_axis('ID').reset_index()
+        self.display = DisplayCatalog(self.metadata)
+        self.memory_bytes["embeddings_mapped"] = int(self.embeddings.nbytes)
+        self.memory_bytes["metadata"] = int(self.metadata.memory_usage(deep=True).sum())
+        self.memory_bytes["display_fragments"] = self.display.memory_bytes()
+
+    @property
+    def index_report_path(self):
+        return self.index_path.with_suffix('.report.json')
+
+    def index_spec(self):
+        """(spec, search_params) of the saved index, as recorded by /create_index; Flat if unknown."""
+        if self.index_report_path.exists():
+            with open(self.index_report_path) as f:
+                report = json.load(f)
+            return report.get("spec", "Flat"), report.get("search_params")
+        return "Flat", None
+
+    def load_index(self):
+        if os.path.exists(self.index_path):
+            self.index = faiss.read_index(str(self.index_path))
+            if self.index.ntotal != self.store.count:
+                # Artworks were embedded after the index was built: rebuild it with the same spec
+                spec, search_params = self.index_spec()
+                self.index = create_faiss_index(self.store, faiss_index_path=str(self.index_path), spec=spec, search_params=search_params)
+            self.index_version = f"file-{os.stat(self.index_path).st_mtime_ns}-{self.index.ntotal}"
+        else:
+            # No prebuilt index yet: build one in memory from the store
+            self.index = create_faiss_index(self.store, faiss_index_path=None)
+            self.index_version = f"store-{os.stat(self.store.meta_path).st_mtime_ns}-{self.index.ntotal}"
+        self.memory_bytes["index"] = int(faiss.serialize_index(self.index).nbytes)
+
+    def load_clusters(self):
+        self.clusters = load_or_compute_clusters(self.store)
+
+    def load_users(self):
+        self.users.open(legacy_csv=self.user_data_csv)
+
+    def stats(self):
+        return {
+            "load_seconds": self.load_seconds,
+            "memory_bytes": self.memory_bytes,
+            "num_artworks": 0 if self.metadata is None else len(self.metadata),
+            "index_size": 0 if self.index is None else int(self.index.ntotal),
+            "index_version": self.index_version,
+        }
@@ -0,0 +1,117 @@
+# Hybrid e5 + SigLIP Text Search Service
+import os
+import sys
+import time
+from pathlib import Path
+
+current_dir = Path(__file__).parent
+SEARCH_DIR = current_dir.parent.parent / 'Search'
+SEARCH_DATA_DIR = current_dir.parent.parent / 'data'
+
+RESULT_COLUMNS = ["image_id", "title", "artist_display", "date_display", "score", "score_e5", "score_clip"]
+
+
+class SearchService:
+    """
+    Wraps Search/search.py's HybridSearcher for the API: the e5 and SigLIP
+    models and both indexes are loaded once at startup.
+
+    The search stack needs open_clip, sentence_transformers and the index
+    files under SEARCH_DATA_DIR; if any is missing the service reports
+    itself unavailable instead of stopping the app.
+
+    SEARCH_COMPRESSION=fp16|sq8|pq serves the compressed indexes built by
+    Search/compressed.py, re-ranked from the memory-mapped embeddings.
+    """
+
+    def __init__(self, data_dir=None, compression=None):
+        self.data_dir = Path(data_dir or os.environ.get("SEARCH_DATA_DIR", SEARCH_DATA_DIR))
+        self.compression = compression or os.environ.get("SEARCH_COMPRESSION") or None
+        self.searcher = None
+        self.error = None
+        self.load_seconds = None
+        self.fusion_methods = ()
+
+    @property
+    def available(self):
+        return self.searcher is not None
+
+    def load(self):
+        start = time.perf_counter()
+        try:
+            if str(SEARCH_DIR) not in sys.path:
+                sys.path.append(str(SEARCH_DIR))
+            from search import HybridSearcher
+            from fusion import FUSION_METHODS
+
+            self.searcher = HybridSearcher(str(self.data_dir), compression=self.compression)
+            self.fusion_methods = FUSION_METHODS
+        except (ImportError, OSError, RuntimeError, ValueError) as e:
+            self.error = repr(e)
+        self.load_seconds = round(time.perf_counter() - start, 4)
+
+    def close(self):
+        if self.searcher is not None:
+            self.searcher.close()
+        self.searcher = None
+
+    def _format(self, query, result, timings):
+        columns = [col for col in RESULT_COLUMNS if col in result.columns]
+        result = result[columns].reset_index(names="row")
+        return {
+            "query": query,
+            "results": result.astype(object).where(result.notna(), None).to_dict(orient="records"),
+            "timings": timings,
+        }
+
+    def filter_key(self, filters):
+        """
+        Validated, hashable form of a filter dict (None when empty); raises
+        ValueError for unknown or unavailable filters.
+        """
+        self.searcher.attributes.validate(filters)
+        return self.searcher.attributes.key(filters) or None
+
+    def search_batch(self, queries, n=25, k=500, method="minmax", filters=None):
+        """Search a list of queries in one batch; one response per query plus the batch timings."""
+        results, timings = self.searcher.search_batch(queries, k, top_n=n, method=method, filters=filters)
+        per_query = [{name: timings[name][i] for name in ("k", "rounds", "overlap")} for i in range(len(queries))]
+        batch_timings = {name: round(ms, 3) for name, ms in timings.items() if name.endswith("_ms")}
+        batch_timings["num_selected"] = timings["num_selected"]
+        return {
+            "results": [self._format(query, result, stats) for query, result, stats in zip(queries, results, per_query)],
+            "timings": batch_timings,
+        }
+
+    def search_many(self, requests):
+        """
+        Answer concurrent (query, n, k, method, filter_key) requests collected
+        by the API's micro-batcher: requests sharing k, method and filters go
+        through one search_batch call, and each response carries its batch's
+        timings.
+        """
+        responses = [None] * len(requests)
+        groups = {}
+        for i, (_, _, k, method, filter_key) in enumerate(requests):
+            groups.setdefault((k, method, filter_key), []).append(i)
+        for (k, method, filter_key), members in groups.items():
+            queries = [requests[i][0] for i in members]
+            n = max(requests[i][1] for i in members)
+            batch = self.search_batch(queries, n=n, k=k, method=method, filters=dict(filter_key or ()))
+            for i, response in zip(members, batch["results"]):
+                response["results"] = response["results"][:requests[i][1]]
+                response["timings"] = {**batch["timings"], **response["timings"], "batch_size": len(members)}
+                responses[i] = response
+        return responses
+
+    def search(self, query, n=25, k=500, method="minmax", filters=None):
+        return self.search_many([(query, n, k, method, self.filter_key(filters))])[0]
+
+    def stats(self):
+        return {
+            "available": self.available,
+            "error": self.error,
+            "load_seconds": self.load_seconds,
+            "compression": self.compression,
+            "memory_bytes": self.searcher.memory_bytes() if self.available else None,
+        }
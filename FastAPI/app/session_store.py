@@ -0,0 +1,84 @@
+# Recommendation Session Store
+import threading
+import time
+from collections import Counter, OrderedDict
+
+
+class SessionStore:
+    """
+    In-process LRU of per-user sessions with a time-to-live.
+
+    Sessions are kept in least-recently-used order, so the expired ones
+    are always at the front: every access drops those first (a session
+    idle for more than `ttl_seconds` starts over), then the least recently
+    used sessions past `max_sessions`. All methods are thread-safe.
+    """
+
+    def __init__(self, max_sessions: int = 10000, ttl_seconds: float = 1800):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions = OrderedDict()  # session_id -> (session, last access time)
+        self._lock = threading.Lock()
+        self.counters = Counter()
+
+    def _evict(self, now):
+        while self._sessions:
+            session_id, (_, last_access) = next(iter(self._sessions.items()))
+            if now - last_access <= self.ttl_seconds:
+                break
+            del self._sessions[session_id]
+            self.counters["expired"] += 1
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.counters["evicted"] += 1
+
+    def get(self, session_id):
+        """The session, or None if it is unknown or has expired."""
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            if session_id not in self._sessions:
+                self.counters["misses"] += 1
+                return None
+            session, _ = self._sessions[session_id]
+            self._sessions[session_id] = (session, now)
+            self._sessions.move_to_end(session_id)
+            self.counters["hits"] += 1
+            return session
+
+    def get_or_create(self, session_id, create):
+        """The session, or a new one from `create()` if it is unknown or has expired."""
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            if session_id in self._sessions:
+                session, _ = self._sessions[session_id]
+                self.counters["hits"] += 1
+            else:
+                session = create()
+                self.counters["created"] += 1
+            self._sessions[session_id] = (session, now)
+            self._sessions.move_to_end(session_id)
+            self._evict(now)
+            return session
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def stats(self):
+        with self._lock:
+            self._evict(time.monotonic())
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "ttl_seconds": self.ttl_seconds,
+                **self.counters,
+            }
@@ -0,0 +1,159 @@
+# User Profile Store
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from vector_store import VectorStore
+
+NEW_USER_VIEWED = 10
+LEGACY_CHOICES = 10  # profiles in user_data.csv came from the 10-question questionnaire
+
+
+class UserProfileStore:
+    """
+    User profiles: a SQLite table (WAL mode) holding each user's id, `viewed`
+    count and number of chosen artworks, plus a memory-mapped VectorStore
+    holding the profile embedding under the same id.
+
+    Writers hold SQLite's write lock (BEGIN IMMEDIATE) for the whole update,
+    so concurrent submissions from any thread or worker are serialized and
+    none is lost. A profile is the running mean of every chosen artwork's
+    embedding, so new choices update it without re-reading old ones.
+    """
+
+    def __init__(self, db_path, vector_dir, dim=1024):
+        self.db_path = Path(db_path)
+        self.vectors = VectorStore(vector_dir, positional_ids=True)  # user_id == row
+        self.dim = dim
+        self._local = threading.local()
+
+    def _connection(self):
+        # One connection per thread; sqlite3 connections are not shared safely
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another worker may have added users since we last looked
+            if self.vectors.exists():
+                self.vectors.refresh()
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def open(self, legacy_csv=None):
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._write() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS users (
+                    username TEXT PRIMARY KEY,
+                    user_id INTEGER UNIQUE NOT NULL,
+                    viewed INTEGER NOT NULL DEFAULT 0,
+                    n_choices INTEGER NOT NULL DEFAULT 0
+                )"""
+            )
+            if not self.vectors.exists():
+                self._migrate(conn, legacy_csv)
+        self.vectors.open()
+        return self
+
+    def _migrate(self, conn, legacy_csv):
+        # One-off import of user_data.csv (username, viewed, emb_*)
+        if legacy_csv is None or not os.path.exists(legacy_csv):
+            VectorStore.create(self.vectors.directory, self.dim)
+            return
+        user_df = pd.read_csv(legacy_csv)
+        # Every row is kept so that user_id stays the row position; a profile
+        # with missing embeddings becomes a zero vector with no choices, which
+        # the first submitted choices then replace
+        embedding_columns = [col for col in user_df.columns if col.startswith("emb_")]
+        complete = user_df[embedding_columns].notna().all(axis=1)
+        user_df[embedding_columns] = user_df[embedding_columns].fillna(0)
+        VectorStore.from_dataframe(self.vectors.directory, user_df, id_column=None)
+        conn.executemany(
+            "INSERT OR REPLACE INTO users (username, user_id, viewed, n_choices) VALUES (?, ?, ?, ?)",
+            [
+                (str(username), user_id, int(viewed), LEGACY_CHOICES if has_profile else 0)
+                for user_id, (username, viewed, has_profile) in enumerate(
+                    zip(user_df['username'], user_df['viewed'], complete)
+                )
+            ],
+        )
+
+    # Reading
+    def get(self, username):
+        """Return (viewed, embedding) for a user, or None if unknown."""
+        row = self._connection().execute(
+            "SELECT user_id, viewed FROM users WHERE username = ?", (username,)
+        ).fetchone()
+        if row is None:
+            return None
+        user_id, viewed = row
+        if user_id not in self.vectors:
+            self.vectors.refresh()
+        return viewed, self.vectors.get([user_id])[0]
+
+    def __contains__(self, username):
+        return self._connection().execute(
+            "SELECT 1 FROM users WHERE username = ?", (username,)
+        ).fetchone() is not None
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    # Writing
+    def add_choices(self, username, embeddings, reset=False):
+        """
+        Fold the embeddings of newly chosen artworks into the user's running
+        mean, creating the user if needed. With `reset=True` the profile is
+        replaced by the mean of these choices alone.
+        """
+        embeddings = np.asarray(embeddings, dtype='float32').reshape(-1, self.vectors.dim)
+        k = len(embeddings)
+        if k == 0:
+            return
+        total = embeddings.sum(axis=0)
+
+        with self._write() as conn:
+            row = conn.execute(
+                "SELECT user_id, n_choices FROM users WHERE username = ?", (username,)
+            ).fetchone()
+            if row is None:
+                # New rows always go at the end of the vector file
+                user_id = self.vectors.count
+                conn.execute(
+                    "INSERT INTO users (username, user_id, viewed, n_choices) VALUES (?, ?, ?, ?)",
+                    (username, user_id, NEW_USER_VIEWED, k),
+                )
+                self.vectors.append([user_id], total / k)
+            else:
+                user_id, n = row
+                if reset:
+                    n = 0
+                mean = (self.vectors.get([user_id])[0] * n + total) / (n + k)
+                conn.execute(
+                    "UPDATE users SET n_choices = ? WHERE user_id = ?", (n + k, user_id)
+                )
+                self.vectors.update([user_id], mean)
+
+    def increment_viewed(self, username, n=1):
+        with self._write() as conn:
+            conn.execute(
+                "UPDATE users SET viewed = viewed + ? WHERE username = ?", (n, username)
+            )
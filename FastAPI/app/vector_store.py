@@ -0,0 +1,211 @@
+# Binary Vector Store
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+VECTORS_FILE = 'vectors.f32'
+IDS_FILE = 'ids.i64'
+META_FILE = 'meta.json'
+
+
+class VectorStore:
+    """
+    Fixed-dimension float32 vectors kept in a directory:
+
+        vectors.f32  contiguous row-major float32 matrix
+        ids.i64      int64 id of each row
+        meta.json    dim, count and any extra metadata
+
+    Readers memory-map the files, so loads are near zero-copy and several
+    worker processes share the same pages. `count` in meta.json is the
+    source of truth: bytes past it (e.g. from an interrupted append) are ignored.
+
+    Appends and refreshes only map and index the new rows. With
+    `positional_ids=True` every id is its row number (ids 0, 1, 2, ... in
+    append order), so no id -> row dict is kept at all.
+    """
+
+    def __init__(self, directory, positional_ids=False):
+        self.directory = Path(directory)
+        self.positional_ids = positional_ids
+        self.meta = {}
+        self.vectors = None
+        self.ids = None
+        self.id_to_row = {}
+
+    # Files
+    @property
+    def vectors_path(self):
+        return self.directory / VECTORS_FILE
+
+    @property
+    def ids_path(self):
+        return self.directory / IDS_FILE
+
+    @property
+    def meta_path(self):
+        return self.directory / META_FILE
+
+    def exists(self):
+        return self.meta_path.exists()
+
+    @property
+    def dim(self):
+        return self.meta["dim"]
+
+    @property
+    def count(self):
+        return self.meta["count"]
+
+    def __len__(self):
+        return self.count
+
+    def _write_meta(self):
+        tmp_path = self.meta_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, self.meta_path)
+
+    # Creation
+    @classmethod
+    def create(cls, directory, dim, **meta):
+        store = cls(directory)
+        store.directory.mkdir(parents=True, exist_ok=True)
+        store.vectors_path.write_bytes(b'')
+        store.ids_path.write_bytes(b'')
+        store.meta = {"dim": int(dim), "count": 0, "dtype": "float32", **meta}
+        store._write_meta()
+        return store.open()
+
+    @classmethod
+    def from_dataframe(cls, directory, df, id_column="ID", embedding_column_prefix="emb_", **meta):
+        """
+        Convert a frame with `emb_*` columns (the old CSV layout) into a store.
+        With `id_column=None` the row position is used as the id. Rows with
+        missing embeddings are skipped.
+
+        The store is written to a private temp directory and renamed into
+        place, so processes migrating at the same time never see a partial
+        store: the first rename wins and the others discard their copy.
+        """
+        embedding_columns = [col for col in df.columns if col.startswith(embedding_column_prefix)]
+        ids = np.arange(len(df)) if id_column is None else df[id_column].to_numpy()
+        vectors = df[embedding_columns].to_numpy(dtype='float32')
+        complete = ~np.isnan(vectors).any(axis=1)
+
+        directory = Path(directory)
+        tmp_dir = directory.with_name(f"{directory.name}.{os.getpid()}.tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        store = cls.create(tmp_dir, len(embedding_columns), **meta)
+        store.append(ids[complete], vectors[complete])
+        try:
+            os.replace(tmp_dir, directory)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not cls(directory).exists():
+                raise
+        return cls(directory).open()
+
+    # Reading
+    def _read_meta(self):
+        with open(self.meta_path) as f:
+            return json.load(f)
+
+    def _map(self):
+        # Mapping is O(1): the OS pages rows in on access
+        count, dim = self.count, self.dim
+        if count:
+            self.vectors = np.memmap(self.vectors_path, dtype='float32', mode='r', shape=(count, dim))
+            self.ids = np.memmap(self.ids_path, dtype='int64', mode='r', shape=(count,))
+        else:
+            self.vectors = np.empty((0, dim), dtype='float32')
+            self.ids = np.empty(0, dtype='int64')
+
+    def _index(self, start):
+        """Add rows start.. to id_to_row."""
+        if not self.positional_ids:
+            self.id_to_row.update((int(id_), row) for row, id_ in enumerate(self.ids[start:].tolist(), start))
+
+    def open(self):
+        self.meta = self._read_meta()
+        self._map()
+        self.id_to_row = {}
+        self._index(0)
+        return self
+
+    def refresh(self):
+        """Map the rows another process has appended since the last open (only those are indexed)."""
+        meta = self._read_meta()
+        old_count = self.meta.get("count")
+        if old_count is None or meta["count"] < old_count:
+            return self.open()
+        if meta["count"] != old_count:
+            self.meta = meta
+            self._map()
+            self._index(old_count)
+        return self
+
+    def __contains__(self, id_):
+        if self.positional_ids:
+            return 0 <= int(id_) < self.count
+        return int(id_) in self.id_to_row
+
+    def rows_of(self, ids):
+        if self.positional_ids:
+            rows = np.asarray(ids, dtype='int64').reshape(-1)
+            if len(rows) and (rows.min() < 0 or rows.max() >= self.count):
+                raise KeyError(f"ids out of range for {self.count} rows")
+            return rows
+        return np.array([self.id_to_row[int(id_)] for id_ in ids], dtype='int64')
+
+    def get(self, ids):
+        return np.asarray(self.vectors[self.rows_of(ids)])
+
+    # Writing
+    def append(self, ids, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype='float32').reshape(-1, self.dim)
+        ids = np.ascontiguousarray(ids, dtype='int64').reshape(-1)
+        if len(ids) != len(vectors):
+            raise ValueError(f"Got {len(ids)} ids for {len(vectors)} vectors")
+        if len(ids) == 0:
+            return self
+
+        count = self.count
+        if self.positional_ids and not np.array_equal(ids, np.arange(count, count + len(ids))):
+            raise ValueError(f"Positional ids must continue from {count}")
+        for path, array, row_bytes in [
+            (self.vectors_path, vectors, self.dim * 4),
+            (self.ids_path, ids, 8),
+        ]:
+            with open(path, 'r+b') as f:
+                f.seek(count * row_bytes)
+                f.write(array.tobytes())
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
+
+        self.meta["count"] = count + len(ids)
+        self._write_meta()
+        self._map()
+        self._index(count)
+        return self
+
+    def update(self, ids, vectors):
+        """Overwrite the vectors of existing ids in place."""
+        rows = self.rows_of(ids)
+        writable = np.memmap(self.vectors_path, dtype='float32', mode='r+', shape=(self.count, self.dim))
+        writable[rows] = np.asarray(vectors, dtype='float32').reshape(len(rows), self.dim)
+        writable.flush()
+        del writable
+
+    def upsert(self, ids, vectors):
+        vectors = np.asarray(vectors, dtype='float32').reshape(-1, self.dim)
+        present = np.array([id_ in self for id_ in ids], dtype=bool).reshape(-1)
+        if present.any():
+            self.update(np.asarray(ids)[present], vectors[present])
+        if (~present).any():
+            self.append(np.asarray(ids)[~present], vectors[~present])
+        return self
@@ -0,0 +1,59 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "app"))
+
+from cache import TwoLevelCache
+
+
+def test_cancelled_first_caller_does_not_strand_waiters():
+    async def scenario():
+        cache = TwoLevelCache(max_items=8)
+        started = asyncio.Event()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            started.set()
+            await asyncio.sleep(0.05)
+            return np.arange(3)
+
+        first = asyncio.create_task(cache.get_or_compute(("results", "q"), compute))
+        await started.wait()
+        second = asyncio.create_task(cache.get_or_compute(("results", "q"), compute))
+        await asyncio.sleep(0)
+        first.cancel()
+
+        value = await asyncio.wait_for(second, timeout=1)
+        assert first.cancelled()
+        assert value.tolist() == [0, 1, 2]
+        assert len(calls) == 2  # the waiter recomputed it
+        assert cache._inflight == {}
+        assert cache.get(("results", "q")).tolist() == [0, 1, 2]
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_computation_running():
+    async def scenario():
+        cache = TwoLevelCache(max_items=8)
+        started = asyncio.Event()
+
+        async def compute():
+            started.set()
+            await asyncio.sleep(0.05)
+            return np.ones(2)
+
+        first = asyncio.create_task(cache.get_or_compute(("results", "q"), compute))
+        await started.wait()
+        second = asyncio.create_task(cache.get_or_compute(("results", "q"), compute))
+        await asyncio.sleep(0)
+        second.cancel()
+
+        assert (await asyncio.wait_for(first, timeout=1)).tolist() == [1, 1]
+        assert second.cancelled()
+
+    asyncio.run(scenario())
@@ -3,22 +3,26 @@ import random
 import numpy as np
 import pandas as pd
 
+from utils.postings import tag_postings
+
 
 class CommonTagsChannel:
-    def __init__(self, metadata, tag_count_all_path):
+    def __init__(self, metadata, tag_count_all_path, num_candidates=None, postings_dir=None, source_path=None):
         self.metadata = metadata
-        self.metadata_explode = metadata[["tags"]].explode("tags")
+        self.num_candidates = num_candidates  # None keeps every artwork with the tag
         self.tag_count_all = pd.read_csv(
             tag_count_all_path,
             usecols=["tag", "count"],
             index_col="tag",
         )
         self.tag_count_all.rename(columns={"count": "count_all"}, inplace=True)
-        self.tag_artworks = self.metadata_explode.groupby("tags").apply(
-            lambda x: list(x.index)
-        )
 
-    def update_data(self, unique_log, tag_log_len, num_tag, interacted_set):
+        # Sparse tag x artwork matrix: compiled posting list (metadata rows) per tag,
+        # memory-mapped from postings_dir when it has a current copy
+        self.tag_postings = tag_postings(metadata, postings_dir, source_path)
+
+    def update_data(self, unique_log, tag_log_len, num_tag):
+        """A user's (tag_list, candidates_list): their top tags and a ranked int32 id array per tag."""
         id_tag_time = (
             unique_log.head(tag_log_len)
             .join(self.metadata)[["tags", "timestamp"]]
@@ -36,22 +40,29 @@ class CommonTagsChannel:
         tag_sorted = tag_time_count.sort_values(
             by=["click_rate", "timestamp"], ascending=[False, False]
         ).head(num_tag)
-        self.tag_list = tag_sorted.index.tolist()
-        tag_rate_dict = tag_sorted["click_rate"].to_dict()
-
-        self.candidates_list = []
-        for tag in self.tag_list:
-            object_ids = self.tag_artworks.loc[tag]
-            obj_tag_scores = (
-                self.metadata.loc[object_ids]["tags"]
-                .apply(
-                    lambda tags: sum(
-                        tag_rate_dict[tag] for tag in tags if tag in tag_rate_dict
-                    )
-                )
-                .sort_values(ascending=False)
-            )
-            self.candidates_list.append(obj_tag_scores.index.tolist())
+        tag_list = tag_sorted.index.tolist()
+
+        click_rates = np.nan_to_num(tag_sorted["click_rate"].to_numpy())
+        tag_rows = [
+            self.tag_postings[tag] if tag in self.tag_postings else np.empty(0, dtype="int32")
+            for tag in tag_list
+        ]
+
+        # Score of every artwork = sum of the click rates of its tags: the sparse matrix
+        # times the click-rate vector, whose only non-zeros are the selected tags
+        scores = np.zeros(self.tag_postings.num_rows)
+        for rows, click_rate in zip(tag_rows, click_rates):
+            np.add.at(scores, rows, click_rate)
+
+        candidates_list = []
+        for rows in tag_rows:
+            tag_scores = scores[rows]
+            if self.num_candidates is not None and len(rows) > self.num_candidates:
+                top = np.argpartition(-tag_scores, self.num_candidates - 1)[: self.num_candidates]
+            else:
+                top = np.arange(len(rows))
+            top = top[np.argsort(-tag_scores[top], kind="stable")]
+            candidates_list.append(np.asarray(self.metadata.index[rows[top]], dtype="int32"))
 
         # Get Related Tags, i.e., tags co-occuring with the selected tags
 
@@ -73,12 +84,13 @@ class CommonTagsChannel:
         # ).index.tolist()
         # print(self.related_tags)
 
-        self.interacted_set = interacted_set
-
         # self.num_tag = num_tag
 
-    def __call__(self, recommended_set):
-        exclude_set = self.interacted_set | recommended_set
+        return tag_list, candidates_list
+
+    def __call__(self, state, exclude_set):
+        tag_list, candidates_list = state
+        excluded = np.fromiter(exclude_set, dtype="int32", count=len(exclude_set))
 
         # if self.num_consec <= self.num_tag and self.num_consec < len(self.related_tags):
         #     new_tag = self.related_tags[self.num_consec - 1]
@@ -88,10 +100,9 @@ class CommonTagsChannel:
         #     self.candidates_list.append(object_ids)
 
         tag_recs_list = [
-            [x for x in object_ids if x not in exclude_set]
-            for object_ids in self.candidates_list
+            object_ids[~np.isin(object_ids, excluded)]
+            for object_ids in candidates_list
         ]
 
-        tag_names = [f"Tag: {x}" for x in self.tag_list]
-        print(tag_names)
+        tag_names = [f"Tag: {x}" for x in tag_list]
         return tag_recs_list, tag_names
@@ -1,55 +1,230 @@
 import os
+import json
 import faiss
 import random
+import hashlib
 import numpy as np
 
+# Map the flat index's vectors instead of reading them into memory (FAISS >= 1.8)
+INDEX_READ_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | getattr(faiss, "IO_FLAG_READ_ONLY", 0)
+
+
+def file_checksum(path, chunk_size=1 << 24):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def write_atomic(path, write):
+    # Write to a private temp file, then rename: readers never see a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def write_json(path, data):
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+
+def save_array(path, array):
+    with open(path, "wb") as f:
+        np.save(f, array)
+
+
+def embeddings_meta(embedding_path):
+    stat = os.stat(embedding_path)
+    return {
+        "embeddings": os.path.basename(embedding_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha1": file_checksum(embedding_path),
+    }
+
+
+def is_current(meta_path, embedding_path):
+    """
+    Whether the sidecar at `meta_path` was written for the current
+    `embedding_path`. A sidecar records the embeddings file's size, mtime
+    and SHA-1 at build time: matching size and mtime means current; if
+    only the mtime changed (e.g. the file was copied), the checksum
+    decides, and the sidecar is updated to the new mtime.
+    """
+    if not os.path.exists(meta_path):
+        return False
+    stat = os.stat(embedding_path)
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta["size"] != stat.st_size:
+        return False
+    if meta["mtime_ns"] == stat.st_mtime_ns:
+        return True
+    if meta["sha1"] == file_checksum(embedding_path):
+        write_atomic(meta_path, lambda path: write_json(path, {**meta, "mtime_ns": stat.st_mtime_ns}))
+        return True
+    return False
+
+
+def load_or_build_index(index_path, embedding_path):
+    """
+    Memory-mapped flat index over `embedding_path`, rebuilt only when stale
+    (see is_current; the sidecar is `<index_path>.json`). A rebuild writes
+    the index and sidecar atomically, so processes starting together never
+    read a half-written file.
+    """
+    meta_path = index_path + ".json"
+    if os.path.exists(index_path) and is_current(meta_path, embedding_path):
+        return faiss.read_index(index_path, INDEX_READ_FLAGS)
+
+    meta = embeddings_meta(embedding_path)
+    embeddings = np.load(embedding_path)
+    index = faiss.IndexFlatIP(embeddings.shape[1])
+    index.add(embeddings)
+    write_atomic(index_path, lambda path: faiss.write_index(index, path))
+    write_atomic(meta_path, lambda path: write_json(path, {**meta, "ntotal": index.ntotal}))
+    return index
+
+
+def neighbor_paths(neighbors_path):
+    return neighbors_path + ".ids.npy", neighbors_path + ".scores.npy", neighbors_path + ".json"
+
+
+def top_k_neighbors(embeddings, k, block_size=1024, column_block_size=16384):
+    """
+    (ids, scores) of every row's k highest inner-product neighbors, itself
+    excluded, best first. Rows are processed block_size at a time against
+    column_block_size catalog rows per matrix product, keeping a running
+    top k, so memory stays at block_size x (k + column_block_size).
+    """
+    n = len(embeddings)
+    k = min(k, n - 1)
+    ids = np.empty((n, k), dtype="int32")
+    scores = np.empty((n, k), dtype="float16")
+
+    for start in range(0, n, block_size):
+        queries = np.asarray(embeddings[start : start + block_size], dtype="float32")
+        rows = np.arange(len(queries))
+        best_ids = np.empty((len(queries), 0), dtype="int32")
+        best_scores = np.empty((len(queries), 0), dtype="float32")
+
+        for col in range(0, n, column_block_size):
+            block = queries @ np.asarray(embeddings[col : col + column_block_size], dtype="float32").T
+            # Each artwork is not its own neighbor
+            own = start + rows - col
+            inside = (own >= 0) & (own < block.shape[1])
+            block[rows[inside], own[inside]] = -np.inf
+
+            best_scores = np.hstack([best_scores, block])
+            best_ids = np.hstack([best_ids, np.broadcast_to(np.arange(col, col + block.shape[1], dtype="int32"), block.shape)])
+            if best_scores.shape[1] > k:
+                top = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, top, axis=1)
+                best_ids = np.take_along_axis(best_ids, top, axis=1)
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        ids[start : start + len(queries)] = np.take_along_axis(best_ids, order, axis=1)
+        scores[start : start + len(queries)] = np.take_along_axis(best_scores, order, axis=1)
+    return ids, scores
+
+
+def build_neighbor_table(neighbors_path, embedding_path, k=500, block_size=1024):
+    """
+    Offline job: the top-k DINO neighbors of every artwork, saved as
+    `<neighbors_path>.ids.npy` (int32) and `.scores.npy` (float16) with a
+    sidecar `.json` for is_current.
+    """
+    meta = embeddings_meta(embedding_path)
+    ids, scores = top_k_neighbors(np.load(embedding_path, mmap_mode="r"), k, block_size)
+    ids_path, scores_path, meta_path = neighbor_paths(neighbors_path)
+    write_atomic(ids_path, lambda path: save_array(path, ids))
+    write_atomic(scores_path, lambda path: save_array(path, scores))
+    write_atomic(meta_path, lambda path: write_json(path, {**meta, "ntotal": len(ids), "k": ids.shape[1]}))
+    return ids, scores
+
+
+def load_neighbor_table(neighbors_path, embedding_path):
+    """Memory-mapped (ids, scores) built by build_neighbor_table, or None if missing or stale."""
+    ids_path, scores_path, meta_path = neighbor_paths(neighbors_path)
+    if not (os.path.exists(ids_path) and os.path.exists(scores_path) and is_current(meta_path, embedding_path)):
+        return None
+    return np.load(ids_path, mmap_mode="r"), np.load(scores_path, mmap_mode="r")
+
 
 class ImageSimChannel:
 
-    def __init__(self, index_path, embedding_path, page_rec_len, shuffle_len):
-        # Embeddings of all images
-        self.embeddings = np.load(embedding_path)
+    def __init__(self, index_path, embedding_path, page_rec_len, shuffle_len, neighbors_path=None):
+        # Embeddings of all images, mapped rather than loaded
+        self.embeddings = np.load(embedding_path, mmap_mode="r")
         self.page_rec_len = page_rec_len
         self.shuffle_len = shuffle_len
 
-        self.index = faiss.IndexFlatIP(self.embeddings.shape[1])
-        self.index.add(self.embeddings)
-        faiss.write_index(self.index, index_path)
+        # Precomputed neighbor table (build_neighbor_table) when it is current; otherwise
+        # the neighbors are searched per page in the flat index
+        self.neighbor_ids = self.neighbor_scores = self.index = None
+        table = None if neighbors_path is None else load_neighbor_table(neighbors_path, embedding_path)
+        if table is not None:
+            self.neighbor_ids, self.neighbor_scores = table
+        else:
+            self.index = load_or_build_index(index_path, embedding_path)
 
-    def update_data(self, unique_log, num_image, interacted_set):
-        self.image_list = unique_log.head(num_image).index.values
-        self.interacted_set = interacted_set
+    def update_data(self, unique_log, num_image):
+        """A user's seed images: the num_image most recently clicked artworks."""
+        return unique_log.head(num_image).index.to_numpy(dtype="int32")
 
-    def get_recs_list(self, object_ids, num_rec_per_image):
-        image_embeddings = self.embeddings[object_ids]
-        D, I = self.index.search(image_embeddings, num_rec_per_image)
-        return I[:, 1:].tolist()
+    def get_recs_list(self, object_ids, num_rec_per_image, exclude_set=frozenset()):
+        if self.neighbor_ids is not None:
+            # Slice each seed's row of the table: its neighbors, best first, itself excluded
+            excluded = np.fromiter(exclude_set, dtype="int32", count=len(exclude_set))
+            neighbors = self.neighbor_ids[np.asarray(object_ids)]
+            keep = ~np.isin(neighbors, excluded)
+            return [recs[mask][:num_rec_per_image].tolist() for recs, mask in zip(neighbors, keep)]
 
-    def __call__(self, recommended_set):
-        exclude_set = self.interacted_set | recommended_set
+        # The exclude set goes to FAISS as an ID selector, so a single search
+        # returns num_rec_per_image usable neighbors for every seed image
+        image_embeddings = np.asarray(self.embeddings[object_ids], dtype="float32")
+        params = None
+        if exclude_set:
+            excluded = faiss.IDSelectorBatch(np.fromiter(exclude_set, dtype="int64", count=len(exclude_set)))
+            selector = faiss.IDSelectorNot(excluded)
+            params = faiss.SearchParameters(sel=selector)
+        D, I = self.index.search(image_embeddings, num_rec_per_image + 1, params=params)
 
-        num_rec = self.page_rec_len * 2
+        # Drop each seed image itself (and the -1 padding of an exhausted catalog)
+        return [
+            [x for x in recs if x != object_id and x >= 0][:num_rec_per_image]
+            for object_id, recs in zip(object_ids, I.tolist())
+        ]
 
-        if len(self.image_list) == 0:
+    def __call__(self, image_list, exclude_set):
+        if len(image_list) == 0:
             return [], []
 
-        recs_list = self.get_recs_list(self.image_list, num_rec)
-        filtered_recs_list = [
-            [x for x in recs if x not in exclude_set] for recs in recs_list
-        ]
-        while any(len(recs) < self.page_rec_len for recs in filtered_recs_list):
-            num_rec += self.page_rec_len
-            recs_list = self.get_recs_list(self.image_list, num_rec)
-            filtered_recs_list = [
-                [x for x in recs if x not in exclude_set] for recs in recs_list
-            ]
+        filtered_recs_list = self.get_recs_list(image_list, self.page_rec_len, exclude_set)
 
         final_recs_list = [
-            random.sample(recs[: self.shuffle_len], self.shuffle_len)
+            random.sample(recs[: self.shuffle_len], min(self.shuffle_len, len(recs)))
             + recs[self.shuffle_len : self.page_rec_len]
             for recs in filtered_recs_list
         ]
 
-        image_names = [f"Image: {x}" for x in self.image_list]
-        print(image_names)
+        image_names = [f"Image: {x}" for x in image_list]
         return final_recs_list, image_names
+
+
+if __name__ == "__main__":
+    # Offline job (run from Recommend/: python -m channels.image_sim [k]): the top-k
+    # DINO neighbor table that ImageSimChannel slices instead of searching
+    import sys
+    import time
+    from recommend import DATA_DIR
+
+    k = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    start = time.perf_counter()
+    ids, _ = build_neighbor_table(
+        os.path.join(DATA_DIR, "dino_neighbors"),
+        os.path.join(DATA_DIR, "search_embeds_dino.npy"),
+        k,
+    )
+    print(f"{ids.shape[1]} neighbors for {len(ids)} artworks in {time.perf_counter() - start:.1f}s")
@@ -1,19 +1,72 @@
 import random
+import numpy as np
+
+
+class AliasTable:
+    """
+    Walker's alias method: after an O(n) build, each draw of an index i
+    with probability weights[i] / sum(weights) costs O(1).
+    """
+
+    def __init__(self, weights):
+        weights = np.nan_to_num(np.asarray(weights, dtype="float64")).clip(min=0)
+        if weights.sum() <= 0:
+            raise ValueError("Random recommendation weights must have a positive sum")
+        n = len(weights)
+        scaled = (weights * n / weights.sum()).tolist()
+
+        self.prob = [1.0] * n
+        self.alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s], self.alias[s] = scaled[s], l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+
+    def __len__(self):
+        return len(self.prob)
+
+    def draw(self):
+        i = random.randrange(len(self.prob))
+        return i if random.random() < self.prob[i] else self.alias[i]
 
 
 class RandomRecChannel:
 
-    def __init__(self, metadata, page_rec_len):
-        self.metadata = metadata
+    def __init__(self, metadata, page_rec_len, weights=None, max_draws_per_rec=10):
+        self.object_ids = metadata.index.to_numpy()
         self.page_rec_len = page_rec_len
+        self.max_draws_per_rec = max_draws_per_rec
+
+        # Optional popularity / recency weighting: a metadata column name or one weight per artwork
+        if isinstance(weights, str):
+            weights = metadata[weights]
+        self.alias_table = None if weights is None else AliasTable(weights)
+
+    def _draw(self):
+        if self.alias_table is None:
+            return random.randrange(len(self.object_ids))
+        return self.alias_table.draw()
 
-    def update_data(self, interacted_set):
-        self.interacted_set = interacted_set
+    def __call__(self, exclude_set):
+        # Rejection sampling against the exclude set: the excluded artworks are a small
+        # part of the catalog, so a page costs O(page_rec_len) draws
+        recs, picked = [], set()
+        for _ in range(self.max_draws_per_rec * self.page_rec_len):
+            if len(recs) == self.page_rec_len:
+                break
+            x = self.object_ids[self._draw()].item()
+            if x not in exclude_set and x not in picked:
+                recs.append(x)
+                picked.add(x)
 
-    def __call__(self, recommended_set):
-        exclude_set = self.interacted_set | recommended_set
+        # Nearly exhausted catalog: fall back to sampling from the remaining artworks
+        if len(recs) < self.page_rec_len:
+            remaining = [x for x in self.object_ids.tolist() if x not in exclude_set and x not in picked]
+            recs += random.sample(remaining, min(self.page_rec_len - len(recs), len(remaining)))
 
-        candidates = self.metadata.drop(exclude_set)
-        random_recs_list = [candidates.sample(n=self.page_rec_len).index.tolist()]
+        random_recs_list = [recs]
 
         return random_recs_list, ["Random"] * len(random_recs_list)
@@ -1,34 +1,44 @@
 import random
+import numpy as np
+
+from utils.postings import artist_postings
 
 
 class SameArtistChannel:
 
-    def __init__(self, metadata):
+    def __init__(self, metadata, num_candidates=None, postings_dir=None, source_path=None):
         self.metadata = metadata
-        self.artist_artworks = metadata.groupby("artist_display").apply(
-            lambda x: list(x.index)
-        )
-
-    def update_data(self, unique_log, num_artist, interacted_set):
-        self.artist_list = (
-            unique_log.head(num_artist).join(self.metadata)["artist_display"].values
+        self.num_candidates = num_candidates  # None keeps every artwork by the artist
+        # Compiled posting list (metadata rows) per artist, memory-mapped and read-only
+        self.artist_postings = artist_postings(metadata, postings_dir, source_path)
+
+    def update_data(self, unique_log, num_artist):
+        """
+        A user's (artist_list, candidates_list): their recent artists and, per
+        artist, up to num_candidates of their artworks in random order (int32 ids).
+        """
+        artist_list = (
+            unique_log.head(num_artist).join(self.metadata)["artist_display"].tolist()
         )
 
-        self.candidates_list = []
-        for artist in self.artist_list:
-            object_ids = self.artist_artworks.loc[artist]
-            random.shuffle(object_ids)
-            self.candidates_list.append(object_ids)
+        candidates_list = []
+        for artist in artist_list:
+            rows = self.artist_postings[artist] if artist in self.artist_postings else np.empty(0, dtype="int32")
+            # Random sample of positions, O(num_candidates): the shared posting list is
+            # never copied or reordered, and the session keeps a bounded list per artist
+            k = len(rows) if self.num_candidates is None else min(self.num_candidates, len(rows))
+            picked = random.sample(range(len(rows)), k)
+            candidates_list.append(np.asarray(self.metadata.index[rows[picked]], dtype="int32"))
 
-        self.interacted_set = interacted_set
+        return artist_list, candidates_list
 
-    def __call__(self, recommended_set):
-        exclude_set = self.interacted_set | recommended_set
+    def __call__(self, state, exclude_set):
+        artist_list, candidates_list = state
+        excluded = np.fromiter(exclude_set, dtype="int32", count=len(exclude_set))
         artist_recs_list = [
-            [x for x in object_ids if x not in exclude_set]
-            for object_ids in self.candidates_list
+            object_ids[~np.isin(object_ids, excluded)]
+            for object_ids in candidates_list
         ]
 
-        artist_names = [f"Artist: {x}" for x in self.artist_list]
-        print(artist_names)
+        artist_names = [f"Artist: {x}" for x in artist_list]
         return artist_recs_list, artist_names
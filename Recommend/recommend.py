@@ -1,27 +1,44 @@
 import os
+import sys
 import ast
+import time
 import random
+import threading
 import pandas as pd
 import numpy as np
 from PIL import Image
 from datetime import datetime
-from collections import deque
 
 from channels.image_sim import ImageSimChannel
 from channels.common_tags import CommonTagsChannel
 from channels.same_artist import SameArtistChannel
 from channels.random_rec import RandomRecChannel
 from utils.debug import save_images
+from utils.interleave import interleave
 
 DATA_DIR = "../data"
 IMAGE_DIR = "../images"
 OUTPUT_DIR = "output"
-
-random.seed(0)
-
-
-def get_metadata():
-    metadata = pd.read_csv(os.path.join(DATA_DIR, "tags_replaced.csv"), index_col=0)
+METADATA_FILE = "tags_replaced.csv"
+
+DEFAULT_CONFIGS = {
+    "page_rec_len": 40,  # Number of recommendations per page
+    "num_interacted": 50,  # Number of unique recently interacted artworks to be excluded from recommendations
+    "num_recommended": 200,  # Number of recently recommended artworks to be excluded from recommendations
+    "num_image": 8,  # Number of unique artworks to create recommendations for
+    # (number of sub-channels in image-based recommendation)
+    "shuffle_len": 20,  # Length of recommendations to shuffle in image-based recommendation
+    "num_artist": 8,  # Number of unique tags to create recommendations for
+    # (number of sub-channels in tag-based recommendation)
+    "num_tag": 8,  # Number of unique tags to create recommendations for
+    # (number of sub-channels in tag-based recommendation)
+    "tag_log_len": 20,  # Number of unique log entries for calculating tag click rates
+    "random_weights": None,  # Optional metadata column (e.g. popularity, recency) weighting the random recommendations
+}
+
+
+def get_metadata(data_dir=DATA_DIR):
+    metadata = pd.read_csv(os.path.join(data_dir, METADATA_FILE), index_col=0)
     metadata["tags"] = metadata["tags"].apply(ast.literal_eval)
     return metadata
 
@@ -42,73 +59,180 @@ def read_user_log():
     return user_log
 
 
-class Recommender:
-    def __init__(self, metadata, configs):
+def unique_clicks(user_log):
+    """Latest click time per object_id, most recent first."""
+    latest_timestamps = user_log.groupby("object_id")["timestamp"].max().to_frame()
+    return latest_timestamps.sort_values("timestamp", ascending=False)
+
+
+def channel_weights(recs_lists):
+    # Sub-channels of one channel share its weight equally (no sub-channels for a user without clicks)
+    return [1 / len(recs_lists)] * len(recs_lists) if recs_lists else []
+
+
+class Session:
+    """
+    One user's recommendation state. Kept to a few small int32 arrays, so
+    that thousands of sessions can share one RecommenderCatalog.
+    """
+
+    __slots__ = (
+        "log_ids",  # unique clicked artworks, most recent first
+        "log_times",
+        "recommended",  # ring buffer of the num_recommended most recently recommended artworks
+        "num_recommended",
+        "num_consec",  # number of consecutive pages without a click
+        "image_list",
+        "artist_state",
+        "tag_state",
+    )
+
+    def __init__(self, num_recommended):
+        self.log_ids = np.empty(0, dtype="int32")
+        self.log_times = np.empty(0, dtype="datetime64[ns]")
+        self.recommended = np.empty(num_recommended, dtype="int32")
+        self.num_recommended = 0
+        self.num_consec = 0
+        self.image_list = np.empty(0, dtype="int32")
+        self.artist_state = ([], [])
+        self.tag_state = ([], [])
+
+    def recommended_ids(self):
+        return self.recommended[: min(self.num_recommended, len(self.recommended))]
+
+    def add_recommended(self, object_ids):
+        capacity = len(self.recommended)
+        if capacity == 0:
+            return
+        object_ids = np.asarray(object_ids, dtype="int32")[-capacity:]
+        slots = (self.num_recommended + np.arange(len(object_ids))) % capacity
+        self.recommended[slots] = object_ids
+        self.num_recommended += len(object_ids)
+
+    def nbytes(self):
+        arrays = [self.log_ids, self.log_times, self.recommended, self.image_list]
+        arrays += list(self.artist_state[1]) + list(self.tag_state[1])
+        return sys.getsizeof(self) + sum(x.nbytes for x in arrays)
+
+
+class RecommenderCatalog:
+    """
+    What all users share, loaded once per process: the metadata, the DINO
+    index and embeddings, the tag and artist posting lists and the random
+    channel's alias table. It is read-only once built; the per-user state
+    lives in a Session, which every method takes as its first argument.
+    """
+
+    def __init__(self, metadata, configs, data_dir=DATA_DIR):
         self.metadata = metadata
         self.configs = configs
-        self.recommended = deque(maxlen=configs["num_recommended"])
+        # Clicks kept per session: the longest history any channel looks at
+        self.log_len = max(configs["num_interacted"], configs["num_image"], configs["num_artist"], configs["tag_log_len"])
+        # Per-thread bitmap over artwork ids used to dedupe each page (cleared after every page)
+        self._local = threading.local()
 
         self.image_sim_channel = ImageSimChannel(
-            index_path=os.path.join(DATA_DIR, f"artworks_dino.index"),
-            embedding_path=os.path.join(DATA_DIR, f"search_embeds_dino.npy"),
+            index_path=os.path.join(data_dir, f"artworks_dino.index"),
+            embedding_path=os.path.join(data_dir, f"search_embeds_dino.npy"),
             page_rec_len=self.configs["page_rec_len"],
             shuffle_len=self.configs["shuffle_len"],
+            neighbors_path=os.path.join(data_dir, "dino_neighbors"),
         )
 
-        self.same_artist_channel = SameArtistChannel(metadata=metadata)
+        metadata_path = os.path.join(data_dir, METADATA_FILE)
+        # Candidates kept per artist / tag in a session: enough to fill a page after the exclusions
+        num_candidates = (
+            self.configs["page_rec_len"]
+            + self.configs["num_interacted"]
+            + self.configs["num_recommended"]
+        )
+        self.same_artist_channel = SameArtistChannel(
+            metadata=metadata,
+            num_candidates=num_candidates,
+            postings_dir=data_dir,
+            source_path=metadata_path,
+        )
 
         self.common_tags_channel = CommonTagsChannel(
             metadata=metadata,
-            tag_count_all_path=os.path.join(DATA_DIR, "tag_count_type.csv"),
+            tag_count_all_path=os.path.join(data_dir, "tag_count_type.csv"),
+            num_candidates=num_candidates,
+            postings_dir=data_dir,
+            source_path=metadata_path,
         )
 
         self.random_rec_channel = RandomRecChannel(
-            metadata=metadata, page_rec_len=self.configs["page_rec_len"]
+            metadata=metadata,
+            page_rec_len=self.configs["page_rec_len"],
+            weights=self.configs.get("random_weights"),
         )
 
-        # Number of consecutive times of recommendation
-        self.num_consec = 0
-
-    def update_data(self, user_log):
-        latest_timestamps = user_log.groupby("object_id")["timestamp"].max().to_frame()
-        unique_log = latest_timestamps.sort_values("timestamp", ascending=False)
-        self.interacted_set = set(unique_log.head(self.configs["num_interacted"]).index)
-        self.image_sim_channel.update_data(
+    def new_session(self):
+        return Session(self.configs["num_recommended"])
+
+    def _seen(self):
+        seen = getattr(self._local, "seen", None)
+        if seen is None:
+            seen = self._local.seen = np.zeros(len(self.metadata), dtype=bool)
+        return seen
+
+    def update_session(self, session, unique_log):
+        """Rebuild the session's channel candidates from `unique_log` (see unique_clicks)."""
+        unique_log = unique_log.head(self.log_len)
+        session.log_ids = unique_log.index.to_numpy(dtype="int32")
+        session.log_times = unique_log["timestamp"].to_numpy(dtype="datetime64[ns]")
+        session.image_list = self.image_sim_channel.update_data(
             unique_log=unique_log,
             num_image=self.configs["num_image"],
-            interacted_set=self.interacted_set,
         )
-        self.same_artist_channel.update_data(
+        session.artist_state = self.same_artist_channel.update_data(
             unique_log=unique_log,
             num_artist=self.configs["num_artist"],
-            interacted_set=self.interacted_set,
         )
-        self.common_tags_channel.update_data(
+        session.tag_state = self.common_tags_channel.update_data(
             unique_log=unique_log,
             tag_log_len=self.configs["tag_log_len"],
             num_tag=self.configs["num_tag"],
-            interacted_set=self.interacted_set,
         )
-        self.random_rec_channel.update_data(
-            interacted_set=self.interacted_set,
+
+        session.num_consec = 0
+
+    def add_clicks(self, session, object_ids, timestamps=None):
+        """Record clicks on `object_ids` (now, unless `timestamps` are given) and update the session."""
+        object_ids = np.asarray(object_ids, dtype="int64")
+        unknown = object_ids[self.metadata.index.get_indexer(object_ids) < 0]
+        if len(unknown):
+            raise ValueError(f"Unknown object ids: {unknown.tolist()}")
+        if timestamps is None:
+            timestamps = [pd.Timestamp.now()] * len(object_ids)
+        user_log = pd.DataFrame(
+            {
+                "object_id": np.concatenate([session.log_ids, object_ids]),
+                "timestamp": np.concatenate([session.log_times, pd.to_datetime(timestamps).to_numpy(dtype="datetime64[ns]")]),
+            }
         )
+        self.update_session(session, unique_clicks(user_log))
 
-        self.num_consec = 0
+    def recommend(self, session):
+        """The session's next page: (object ids, channel name of each, page stats)."""
+        start = time.perf_counter()
+        interacted = session.log_ids[: self.configs["num_interacted"]]
+        recommended = session.recommended_ids()
+        exclude_set = set(interacted.tolist()) | set(recommended.tolist())
 
-    def recommend(self):
-        image_recs_list, image_names = self.image_sim_channel(set(self.recommended))
-        artist_recs_list, artist_names = self.same_artist_channel(set(self.recommended))
-        tag_recs_list, tag_names = self.common_tags_channel(set(self.recommended))
-        random_recs_list, random_names = self.random_rec_channel(set(self.recommended))
+        image_recs_list, image_names = self.image_sim_channel(session.image_list, exclude_set)
+        artist_recs_list, artist_names = self.same_artist_channel(session.artist_state, exclude_set)
+        tag_recs_list, tag_names = self.common_tags_channel(session.tag_state, exclude_set)
+        random_recs_list, random_names = self.random_rec_channel(exclude_set)
 
-        self.num_consec += 1
+        session.num_consec += 1
 
         weights = (
-            [1 / len(image_recs_list)] * len(image_recs_list)
-            + [1 / len(artist_recs_list)] * len(artist_recs_list)
-            + [1 / len(tag_recs_list)] * len(tag_recs_list)
+            channel_weights(image_recs_list)
+            + channel_weights(artist_recs_list)
+            + channel_weights(tag_recs_list)
             + [
-                self.num_consec
+                session.num_consec
             ]  # weight for the random rec channel, which becomes larger when the user browsers recommendation pages consecutively without clicking anything
         )
 
@@ -116,25 +240,50 @@ class Recommender:
             image_recs_list + artist_recs_list + tag_recs_list + random_recs_list
         )
         all_channel_names = image_names + artist_names + tag_names + random_names
-        num_channels = len(all_channel_recs)
-        print(len(artist_recs_list))
-        positions = [0] * num_channels
-
-        recs = []
-        rec_channels = []
-        while len(recs) < self.configs["page_rec_len"]:
-            channel_idx = random.choices(range(num_channels), weights=weights, k=1)[0]
-
-            if positions[channel_idx] < len(all_channel_recs[channel_idx]):
-                x = all_channel_recs[channel_idx][positions[channel_idx]]
-                if x not in self.recommended:
-                    recs.append(x)
-                    rec_channels.append(all_channel_names[channel_idx])
-                    self.recommended.append(x)
-                    positions[channel_idx] += 1
+        channels_ms = 1000 * (time.perf_counter() - start)
+
+        recs, rec_channel_idx, page_stats = interleave(
+            all_channel_recs,
+            weights,
+            self.configs["page_rec_len"],
+            self._seen(),
+            exclude=recommended,
+            # Seeded from `random`, so a seeded run is reproducible
+            rng=np.random.default_rng(random.getrandbits(64)),
+        )
+        session.add_recommended(recs)
+        rec_channels = [all_channel_names[i] for i in rec_channel_idx]
+        for name, channel_stats in zip(all_channel_names, page_stats["channels"]):
+            channel_stats["name"] = name
+        page_stats["channels_ms"] = channels_ms
+        page_stats["total_ms"] = 1000 * (time.perf_counter() - start)
+        return recs, rec_channels, page_stats
+
+
+class Recommender:
+    """A catalog and a single session, for running this script on one user log."""
 
+    def __init__(self, metadata, configs, catalog=None):
+        self.metadata = metadata
+        self.configs = configs
+        self.catalog = catalog or RecommenderCatalog(metadata, configs)
+        self.session = self.catalog.new_session()
+        self.page_stats = None
+
+    def update_data(self, user_log):
+        self.catalog.update_session(self.session, unique_clicks(user_log))
+
+    def recommend(self):
+        recs, rec_channels, self.page_stats = self.catalog.recommend(self.session)
+
+        print([channel["name"] for channel in self.page_stats["channels"]])
         print(recs)
         print(rec_channels)
+        print(
+            f"{len(recs)}/{self.configs['page_rec_len']} recommendations in {self.page_stats['total_ms']:.1f} ms "
+            f"(channels {self.page_stats['channels_ms']:.1f} ms, merge {self.page_stats['merge_ms']:.1f} ms, "
+            f"{self.page_stats['num_draws']} draws)"
+        )
 
         result = metadata.iloc[recs].copy()
         if len(result) > 0:
@@ -166,19 +315,8 @@ class Recommender:
 
 if __name__ == "__main__":
 
-    configs = {
-        "page_rec_len": 40,  # Number of recommendations per page
-        "num_interacted": 50,  # Number of unique recently interacted artworks to be excluded from recommendations
-        "num_recommended": 200,  # Number of recently recommended artworks to be excluded from recommendations
-        "num_image": 8,  # Number of unique artworks to create recommendations for
-        # (number of sub-channels in image-based recommendation)
-        "shuffle_len": 20,  # Length of recommendations to shuffle in image-based recommendation
-        "num_artist": 8,  # Number of unique tags to create recommendations for
-        # (number of sub-channels in tag-based recommendation)
-        "num_tag": 8,  # Number of unique tags to create recommendations for
-        # (number of sub-channels in tag-based recommendation)
-        "tag_log_len": 20,  # Number of unique log entries for calculating tag click rates
-    }
+    random.seed(0)
+    configs = dict(DEFAULT_CONFIGS)
 
     metadata = get_metadata()
     recommender = Recommender(metadata=metadata, configs=configs)
@@ -0,0 +1,81 @@
+import time
+import numpy as np
+
+
+def interleave(channel_recs, weights, num_recs, seen, exclude=(), rng=None):
+    """
+    Merge the channels' ranked lists into one page of up to num_recs
+    artworks.
+
+    Channel assignments are drawn in bulk from the channels' weights; each
+    drawn channel contributes its next artwork not yet `seen`. `seen` is a
+    boolean bitmap over artwork ids (metadata rows), shared across pages:
+    the `exclude` ids are marked on entry and every bit set here is cleared
+    again on exit, so a page costs O(page + exclude) whatever the catalog
+    size. A channel that runs dry is dropped from the distribution, so the
+    loop always ends: every draw either consumes a list entry or removes
+    a channel.
+
+    Returns (recs, channel index of each rec, stats), where stats has the
+    draw count, timing and, per channel, how many artworks it filled and
+    how many of its entries were skipped as already seen.
+    """
+    start = time.perf_counter()
+    rng = np.random.default_rng() if rng is None else rng
+    weights = np.asarray(weights, dtype="float64")
+    lengths = np.array([len(recs) for recs in channel_recs], dtype="int64")
+    positions = np.zeros(len(channel_recs), dtype="int64")
+    filled = np.zeros(len(channel_recs), dtype="int64")
+    skipped = np.zeros(len(channel_recs), dtype="int64")
+    active = (weights > 0) & (lengths > 0)
+
+    exclude = np.fromiter(exclude, dtype="int64")
+    seen[exclude] = True
+    recs, rec_channels = [], []
+    num_draws = num_rounds = 0
+    try:
+        while len(recs) < num_recs and active.any():
+            num_rounds += 1
+            p = np.where(active, weights, 0)
+            draws = rng.choice(len(channel_recs), size=num_recs - len(recs), p=p / p.sum())
+            num_draws += len(draws)
+            for c in draws:
+                if not active[c]:
+                    continue
+                recs_c, pos = channel_recs[c], positions[c]
+                while pos < lengths[c] and seen[recs_c[pos]]:
+                    pos += 1
+                skipped[c] += pos - positions[c]
+                if pos == lengths[c]:
+                    positions[c] = pos
+                    active[c] = False
+                    continue
+                x = recs_c[pos]
+                seen[x] = True
+                recs.append(int(x))
+                rec_channels.append(int(c))
+                filled[c] += 1
+                positions[c] = pos + 1
+                if len(recs) == num_recs:
+                    break
+    finally:
+        seen[exclude] = False
+        seen[recs] = False
+
+    stats = {
+        "merge_ms": 1000 * (time.perf_counter() - start),
+        "num_recs": len(recs),
+        "num_draws": num_draws,
+        "num_rounds": num_rounds,
+        "channels": [
+            {
+                "weight": float(weights[c]),
+                "available": int(lengths[c]),
+                "filled": int(filled[c]),
+                "skipped": int(skipped[c]),
+                "exhausted": bool(positions[c] == lengths[c]),
+            }
+            for c in range(len(channel_recs))
+        ],
+    }
+    return recs, rec_channels, stats
@@ -0,0 +1,154 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+
+class PostingLists:
+    """
+    Compiled inverted index: for each key (a tag or an artist), the metadata
+    rows that have it, stored as two flat arrays.
+
+    The rows of key i are ids[offsets[i]:offsets[i + 1]] (int32 row
+    positions). Saved as <name>.offsets.npy, <name>.ids.npy and <name>.json
+    (keys, a fingerprint of the source column and the size / mtime of the
+    source file), and memory-mapped read-only when loaded, so every process
+    shares one copy of the arrays. Callers that reorder a posting list must
+    copy it first.
+    """
+
+    def __init__(self, keys, offsets, ids, num_rows, fingerprint=None, source=None):
+        self.keys = list(keys)
+        self.key_ids = {key: i for i, key in enumerate(self.keys)}
+        self.offsets = offsets
+        self.ids = ids
+        self.num_rows = num_rows
+        self.fingerprint = fingerprint
+        self.source = source  # {"size", "mtime_ns"} of the file the column was read from
+
+    @staticmethod
+    def source_stat(source_path):
+        if source_path is None:
+            return None
+        stat = os.stat(source_path)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    @staticmethod
+    def column_fingerprint(values):
+        return str(int(pd.util.hash_pandas_object(values.astype(str), index=True).sum() % (1 << 63)))
+
+    @classmethod
+    def build(cls, values, num_rows):
+        """`values`: one key per entry, indexed by row position (e.g. an exploded column)."""
+        values = values.dropna()
+        key_codes, keys = pd.factorize(values, sort=True)
+        order = np.argsort(key_codes, kind="stable")
+        ids = values.index.to_numpy()[order].astype("int32")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(key_codes, minlength=len(keys)))]).astype("int64")
+        ids.flags.writeable = False
+        offsets.flags.writeable = False
+        return cls(keys.tolist(), offsets, ids, num_rows, cls.column_fingerprint(values))
+
+    @staticmethod
+    def _paths(directory, name):
+        base = os.path.join(directory, name)
+        return base + ".offsets.npy", base + ".ids.npy", base + ".json"
+
+    def save(self, directory, name):
+        # Temp files + rename, so a concurrent reader never sees a partial artifact
+        offsets_path, ids_path, meta_path = self._paths(directory, name)
+        suffix = f".{os.getpid()}.tmp"
+        for path, array in ((offsets_path, self.offsets), (ids_path, self.ids)):
+            with open(path + suffix, "wb") as f:
+                np.save(f, array)
+        self._write_meta(meta_path + suffix)
+        for path in (offsets_path, ids_path, meta_path):
+            os.replace(path + suffix, path)
+
+    def _write_meta(self, path):
+        with open(path, "w") as f:
+            json.dump({"keys": self.keys, "num_rows": self.num_rows, "fingerprint": self.fingerprint, "source": self.source}, f)
+
+    @classmethod
+    def load(cls, directory, name):
+        offsets_path, ids_path, meta_path = cls._paths(directory, name)
+        with open(meta_path) as f:
+            meta = json.load(f)
+        return cls(
+            meta["keys"],
+            np.load(offsets_path, mmap_mode="r"),
+            np.load(ids_path, mmap_mode="r"),
+            meta["num_rows"],
+            meta["fingerprint"],
+            meta.get("source"),
+        )
+
+    @classmethod
+    def load_or_build(cls, get_values, num_rows, directory=None, name=None, source_path=None):
+        """
+        The saved artifact if it is current, else a fresh build (saved for
+        the next start when `directory` is given). `get_values()` returns
+        the key column and is only called when needed: an artifact whose
+        recorded size and mtime match the `source_path` file is loaded as
+        is; only otherwise is the column fingerprinted and compared.
+        """
+        source = cls.source_stat(source_path)
+        values = None
+        if directory is not None and all(os.path.exists(path) for path in cls._paths(directory, name)):
+            postings = cls.load(directory, name)
+            if postings.num_rows == num_rows:
+                if source is not None and postings.source == source:
+                    return postings
+                values = get_values()
+                if postings.fingerprint == cls.column_fingerprint(values.dropna()):
+                    if source is not None:
+                        # Same column from a touched or copied file: record its new stat
+                        postings.source = source
+                        meta_path = cls._paths(directory, name)[2]
+                        tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+                        postings._write_meta(tmp_path)
+                        os.replace(tmp_path, meta_path)
+                    return postings
+        postings = cls.build(get_values() if values is None else values, num_rows)
+        postings.source = source
+        if directory is not None:
+            postings.save(directory, name)
+        return postings
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.key_ids
+
+    def rows(self, key_id):
+        return self.ids[self.offsets[key_id] : self.offsets[key_id + 1]]
+
+    def __getitem__(self, key):
+        return self.rows(self.key_ids[key])
+
+
+def tag_postings(metadata, directory=None, source_path=None):
+    """Rows per tag of metadata["tags"] (lists of tags), read from `source_path`."""
+    return PostingLists.load_or_build(
+        lambda: metadata["tags"].reset_index(drop=True).explode(),
+        len(metadata), directory, "postings_tags", source_path,
+    )
+
+
+def artist_postings(metadata, directory=None, source_path=None):
+    """Rows per artist_display, read from `source_path`."""
+    return PostingLists.load_or_build(
+        lambda: metadata["artist_display"].reset_index(drop=True),
+        len(metadata), directory, "postings_artists", source_path,
+    )
+
+
+if __name__ == "__main__":
+    # Compile the posting lists offline (run from Recommend/: python -m utils.postings)
+    from recommend import DATA_DIR, METADATA_FILE, get_metadata
+
+    metadata = get_metadata()
+    source_path = os.path.join(DATA_DIR, METADATA_FILE)
+    for postings in (tag_postings(metadata, DATA_DIR, source_path), artist_postings(metadata, DATA_DIR, source_path)):
+        print(len(postings), "keys,", len(postings.ids), "postings")
@@ -0,0 +1,225 @@
+import json
+import time
+import argparse
+
+import faiss
+import numpy as np
+import pandas as pd
+
+from fusion import FUSION_METHODS, fuse
+
+
+DATA_DIR = "../data"
+INDEX_SPECS = ("Flat", "HNSW32", "IVF{nlist},Flat|nprobe=16")
+
+
+def normalize(x):
+    return (x / np.linalg.norm(x, axis=1, keepdims=True)).astype("float32")
+
+
+def synthetic_dataset(n_items=5000, n_queries=100, dims=(64, 96), n_topics=50, n_relevant=20, seed=0):
+    """
+    Stand-in for the e5 and SigLIP embeddings, so the benchmark runs
+    without downloading either model.
+
+    Items and queries are drawn around shared latent "topics"; each model
+    sees its own noisy random projection of the latent vectors, so the two
+    rankings disagree the way two real encoders do. A query's relevant
+    items are its n_relevant nearest items in the latent space.
+
+    Returns (corpus, query_embeddings, relevant): corpus and query_embeddings
+    map "e5" / "clip" to normalized float32 arrays, relevant is a list of
+    row-id sets, one per query.
+    """
+    rng = np.random.default_rng(seed)
+    latent_dim = 32
+    topics = rng.standard_normal((n_topics, latent_dim))
+    items = topics[rng.integers(n_topics, size=n_items)] + 0.8 * rng.standard_normal((n_items, latent_dim))
+    queries = topics[rng.integers(n_topics, size=n_queries)] + 0.5 * rng.standard_normal((n_queries, latent_dim))
+
+    latent_sims = normalize(queries) @ normalize(items).T
+    relevant = [set(row) for row in np.argsort(-latent_sims, axis=1)[:, :n_relevant].tolist()]
+
+    corpus, query_embeddings = {}, {}
+    for name, dim in zip(("e5", "clip"), dims):
+        projection = rng.standard_normal((latent_dim, dim))
+        corpus[name] = normalize(items @ projection + 2.0 * rng.standard_normal((n_items, dim)))
+        query_embeddings[name] = normalize(queries @ projection + 2.0 * rng.standard_normal((n_queries, dim)))
+    return corpus, query_embeddings, relevant
+
+
+def load_queries(path):
+    """
+    Query set: a .jsonl file of {"query": ..., "relevant": [image_id, ...]}
+    lines ("relevant" optional), or a text file with one query per line.
+    Returns (queries, relevant image ids or None per query).
+    """
+    queries, labels = [], []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                record = json.loads(line)
+                queries.append(record["query"])
+                labels.append(record.get("relevant"))
+            else:
+                queries.append(line)
+                labels.append(None)
+    return queries, labels
+
+
+def build_index(embeddings, spec):
+    """
+    FAISS index_factory index (inner product) for `spec`. "{nlist}" is
+    replaced by ~4*sqrt(n), and search parameters may follow a "|", e.g.
+    "IVF{nlist},Flat|nprobe=16".
+    """
+    spec, _, params = spec.partition("|")
+    spec = spec.format(nlist=max(1, int(4 * np.sqrt(len(embeddings)))))
+    index = faiss.index_factory(embeddings.shape[1], spec, faiss.METRIC_INNER_PRODUCT)
+    if not index.is_trained:
+        index.train(embeddings)
+    index.add(embeddings)
+    if params:
+        faiss.ParameterSpace().set_index_parameters(index, params)
+    return index
+
+
+def recall_at(ranked, relevant, n):
+    return len(set(ranked[:n]) & relevant) / min(n, len(relevant))
+
+
+def ndcg_at(ranked, relevant, n):
+    gains = np.array([item in relevant for item in ranked[:n]], dtype="float64")
+    discounts = 1 / np.log2(np.arange(2, n + 2))
+    ideal = discounts[: min(n, len(relevant))].sum()
+    return float(gains @ discounts[: len(gains)] / ideal)
+
+
+def percentile_ms(seconds, q):
+    return float(1000 * np.percentile(seconds, q))
+
+
+def run_benchmark(corpus, query_embeddings, relevant=None, encode_seconds=None, specs=INDEX_SPECS, methods=FUSION_METHODS, k=500, top_n=25):
+    """
+    Time every index configuration x fusion method on the same queries.
+
+    Queries are encoded once (encode_seconds holds the measured per-query
+    encode time, zero for precomputed embeddings); for each configuration
+    every query is searched in both indexes and fused one at a time, and
+    end-to-end latency is encode + search + fusion.
+
+    Quality is recall@top_n / nDCG@top_n against `relevant` (row-id sets;
+    None entries are skipped) and, for approximate indexes, the share of
+    the exact (first spec, usually Flat) top_n that is returned.
+    Returns one report row per configuration and method.
+    """
+    n_queries = len(query_embeddings["e5"])
+    encode_seconds = np.zeros(n_queries) if encode_seconds is None else np.asarray(encode_seconds)
+    labelled = [] if relevant is None else [i for i, labels in enumerate(relevant) if labels]
+    exact = {}
+
+    report = []
+    for spec in specs:
+        start = time.perf_counter()
+        indexes = {name: build_index(corpus[name], spec) for name in ("e5", "clip")}
+        build_seconds = time.perf_counter() - start
+        index_k = min(k, len(corpus["e5"]))
+
+        # Both indexes searched once per query; the fusion methods reuse the same hits
+        search_seconds, hits = np.zeros(n_queries), []
+        for i in range(n_queries):
+            start = time.perf_counter()
+            D_e5, I_e5 = indexes["e5"].search(query_embeddings["e5"][i : i + 1], index_k)
+            D_clip, I_clip = indexes["clip"].search(query_embeddings["clip"][i : i + 1], index_k)
+            search_seconds[i] = time.perf_counter() - start
+            hits.append((D_e5[0], I_e5[0], D_clip[0], I_clip[0]))
+
+        for method in methods:
+            fusion_seconds, rankings = np.zeros(n_queries), []
+            for i, (D_e5, I_e5, D_clip, I_clip) in enumerate(hits):
+                start = time.perf_counter()
+                ids, _, _ = fuse([I_e5, I_clip], [D_e5, D_clip], method=method)
+                fusion_seconds[i] = time.perf_counter() - start
+                rankings.append(ids[:top_n].tolist())
+
+            exact.setdefault(method, rankings)
+            end_to_end = encode_seconds + search_seconds + fusion_seconds
+            report.append({
+                "index": spec,
+                "method": method,
+                "build_s": round(build_seconds, 3),
+                "encode_ms": 1000 * encode_seconds.mean(),
+                "search_ms": 1000 * search_seconds.mean(),
+                "fusion_ms": 1000 * fusion_seconds.mean(),
+                "p50_ms": percentile_ms(end_to_end, 50),
+                "p95_ms": percentile_ms(end_to_end, 95),
+                "p99_ms": percentile_ms(end_to_end, 99),
+                f"recall@{top_n}": np.mean([recall_at(rankings[i], relevant[i], top_n) for i in labelled]) if labelled else None,
+                f"ndcg@{top_n}": np.mean([ndcg_at(rankings[i], relevant[i], top_n) for i in labelled]) if labelled else None,
+                f"exact_overlap@{top_n}": np.mean([
+                    len(set(ranked) & set(reference)) / max(1, len(reference))
+                    for ranked, reference in zip(rankings, exact[method])
+                ]),
+            })
+    return pd.DataFrame(report)
+
+
+def encode_with_models(queries, data_dir):
+    """
+    Encode a query set with the real e5 and SigLIP models, one query at a
+    time as the API does, and return the catalog vectors of the existing
+    flat indexes as the corpus.
+    """
+    from search import HybridSearcher
+
+    searcher = HybridSearcher(data_dir)
+    query_embeddings = {"e5": [], "clip": []}
+    encode_seconds = np.zeros(len(queries))
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        query_embeddings["e5"].append(searcher.encode_e5([query]))
+        query_embeddings["clip"].append(searcher.encode_clip([query]))
+        encode_seconds[i] = time.perf_counter() - start
+    query_embeddings = {name: np.concatenate(vectors).astype("float32") for name, vectors in query_embeddings.items()}
+    corpus = {
+        "e5": searcher.e5_index.reconstruct_n(0, searcher.e5_index.ntotal),
+        "clip": searcher.clip_index.reconstruct_n(0, searcher.clip_index.ntotal),
+    }
+    image_ids = searcher.metadata["image_id"].astype(str)
+    searcher.close()
+    return corpus, query_embeddings, encode_seconds, pd.Series(np.arange(len(image_ids)), index=image_ids.to_numpy())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency and quality benchmark for the e5 + SigLIP search")
+    parser.add_argument("--queries", help=".jsonl query set with optional relevance labels, or one query per line; "
+                                          "encoded with the real models. Without it, synthetic embeddings are used.")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--specs", nargs="+", default=list(INDEX_SPECS), help="FAISS index_factory strings, the exact one first")
+    parser.add_argument("--methods", nargs="+", default=list(FUSION_METHODS), choices=FUSION_METHODS)
+    parser.add_argument("--k", type=int, default=500)
+    parser.add_argument("--top-n", type=int, default=25)
+    parser.add_argument("--n-items", type=int, default=5000, help="synthetic catalog size")
+    parser.add_argument("--n-queries", type=int, default=100, help="number of synthetic queries")
+    parser.add_argument("--output", help="write the report as .csv or .json")
+    args = parser.parse_args()
+
+    if args.queries:
+        queries, labels = load_queries(args.queries)
+        corpus, query_embeddings, encode_seconds, rows = encode_with_models(queries, args.data_dir)
+        relevant = [None if ids is None else set(rows.reindex([str(i) for i in ids]).dropna().astype(int)) for ids in labels]
+    else:
+        corpus, query_embeddings, relevant = synthetic_dataset(args.n_items, args.n_queries)
+        encode_seconds = None
+
+    report = run_benchmark(corpus, query_embeddings, relevant, encode_seconds, args.specs, args.methods, args.k, args.top_n)
+    with pd.option_context("display.width", 200, "display.max_columns", None, "display.precision", 3):
+        print(report)
+    if args.output:
+        if args.output.endswith(".json"):
+            report.to_json(args.output, orient="records", indent=2)
+        else:
+            report.to_csv(args.output, index=False)
@@ -0,0 +1,144 @@
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+
+DATA_DIR = "../data"
+
+# Codec -> FAISS index_factory string. PQ goes through a single-list IVF so
+# that ID selectors (metadata filters) still work; the scan stays exhaustive.
+# "np" skips polysemous training, which only helps Hamming-filtered search.
+CODECS = {
+    "fp16": "SQfp16",
+    "sq8": "SQ8",
+    "pq": "IVF1,PQ{m}x8np",
+}
+
+
+def vectors_path(data_dir, name):
+    return os.path.join(data_dir, f"search_embeds_{name}_v2.npy")
+
+
+def index_path(data_dir, name, codec=None):
+    return os.path.join(data_dir, f"artworks_{name}.index" if codec is None else f"artworks_{name}.{codec}.index")
+
+
+def build_compressed_index(embeddings, codec):
+    """Inner-product index storing `embeddings` with `codec` (fp16, sq8 or pq: 8 dims per byte-sized code)."""
+    dim = embeddings.shape[1]
+    spec = CODECS[codec].format(m=dim // 8)
+    index = faiss.index_factory(dim, spec, faiss.METRIC_INNER_PRODUCT)
+    if not index.is_trained:
+        index.train(embeddings)
+    index.add(embeddings)
+    return index
+
+
+def index_memory_bytes(index):
+    index = getattr(index, "base_index", index)
+    code_bytes = index.sa_code_size() * index.ntotal
+    # Inverted lists also keep an int64 id per vector
+    return int(code_bytes + (8 * index.ntotal if isinstance(index, faiss.IndexIVF) else 0))
+
+
+class RerankedIndex:
+    """
+    A compressed FAISS index whose candidates are re-scored exactly.
+
+    The compressed index returns rerank_factor * k candidates per query;
+    their float32 vectors are read from the memory-mapped .npy file and the
+    exact inner products decide the final top k. Only the compressed codes
+    live in process memory; the full-precision file is shared through the
+    page cache and only the candidate rows are touched.
+
+    Mirrors the parts of the FAISS index API that HybridSearcher uses.
+    """
+
+    def __init__(self, base_index, vectors, rerank_factor=2):
+        self.base_index = base_index
+        self.vectors = vectors
+        self.rerank_factor = rerank_factor
+
+    @property
+    def ntotal(self):
+        return self.base_index.ntotal
+
+    @property
+    def d(self):
+        return self.base_index.d
+
+    def reconstruct_n(self, start, n):
+        return np.asarray(self.vectors[start:start + n], dtype="float32")
+
+    def search(self, x, k, params=None):
+        n_candidates = min(self.ntotal, max(k, self.rerank_factor * k))
+        _, candidates = self.base_index.search(x, n_candidates, params=params)
+
+        D = np.full((len(x), k), -np.finfo("float32").max, dtype="float32")
+        I = np.full((len(x), k), -1, dtype="int64")
+        for i, rows in enumerate(candidates):
+            rows = np.sort(rows[rows >= 0])  # sorted rows read the memory map front to back
+            scores = np.asarray(self.vectors[rows], dtype="float32") @ x[i]
+            top = np.argsort(-scores, kind="stable")[:k]
+            D[i, : len(top)] = scores[top]
+            I[i, : len(top)] = rows[top]
+        return D, I
+
+
+def load_index(data_dir, name, codec=None, rerank_factor=2):
+    """
+    The `name` ("e5" or "clip") search index: the flat float32 index when
+    codec is None, else the compressed one wrapped in a RerankedIndex over
+    the memory-mapped embeddings.
+    """
+    if codec is None:
+        return faiss.read_index(index_path(data_dir, name))
+    if codec not in CODECS:
+        raise ValueError(f"Unknown codec {codec!r}; use one of {', '.join(CODECS)}")
+    base_index = faiss.read_index(index_path(data_dir, name, codec))
+    vectors = np.load(vectors_path(data_dir, name), mmap_mode="r")
+    if len(vectors) != base_index.ntotal:
+        raise RuntimeError(f"{index_path(data_dir, name, codec)} is stale: {base_index.ntotal} codes for {len(vectors)} vectors")
+    return RerankedIndex(base_index, vectors, rerank_factor)
+
+
+def compare_with_exact(embeddings, index, n_queries=200, top_n=25, seed=0):
+    """Mean recall@top_n of `index` against exact search, with catalog vectors as queries."""
+    rng = np.random.default_rng(seed)
+    queries = np.ascontiguousarray(embeddings[rng.choice(len(embeddings), min(n_queries, len(embeddings)), replace=False)])
+    exact = faiss.IndexFlatIP(embeddings.shape[1])
+    exact.add(embeddings)
+    _, I_exact = exact.search(queries, top_n)
+    start = time.perf_counter()
+    _, I = index.search(queries, top_n)
+    search_ms = 1000 * (time.perf_counter() - start) / len(queries)
+    recall = np.mean([len(set(a) & set(b)) / top_n for a, b in zip(I, I_exact)])
+    return recall, search_ms
+
+
+if __name__ == "__main__":
+    # python compressed.py [fp16|sq8|pq ...]: build the compressed e5 and SigLIP indexes
+    codecs = sys.argv[1:] or list(CODECS)
+
+    for name in ("e5", "clip"):
+        embeddings = np.ascontiguousarray(np.load(vectors_path(DATA_DIR, name)), dtype="float32")
+        flat_bytes = embeddings.nbytes
+        print(name, embeddings.shape, f"flat: {flat_bytes / 2**20:.1f} MiB")
+
+        for codec in codecs:
+            start = time.perf_counter()
+            base_index = build_compressed_index(embeddings, codec)
+            faiss.write_index(base_index, index_path(DATA_DIR, name, codec))
+            build_s = time.perf_counter() - start
+
+            index = load_index(DATA_DIR, name, codec)
+            recall, search_ms = compare_with_exact(embeddings, index)
+            recall_no_rerank, _ = compare_with_exact(embeddings, base_index)
+            size = index_memory_bytes(index)
+            print(
+                f"  {codec}: {size / 2**20:.1f} MiB ({flat_bytes / size:.1f}x smaller), built in {build_s:.1f}s, "
+                f"recall@25 {recall:.3f} re-ranked / {recall_no_rerank:.3f} codes only, {search_ms:.2f} ms/query"
+            )
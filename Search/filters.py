@@ -0,0 +1,162 @@
+import ast
+from functools import lru_cache
+
+import faiss
+import numpy as np
+import pandas as pd
+
+
+# Filter name -> paintings_v2.csv column(s)
+CATEGORICAL_FIELDS = {
+    "artist": "artist_display",
+    "source": "source",
+    "medium": "medium",
+    "movement": "movement",
+}
+TAG_COLUMNS = ("tags", "style_tags", "theme_tags")
+FILTER_FIELDS = (*CATEGORICAL_FIELDS, "tags", "year_min", "year_max")
+
+
+def _as_list(value):
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return list(value)
+    return [value]
+
+
+def _parse_tags(value):
+    if isinstance(value, str):
+        try:
+            value = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            return [value]
+    return value if isinstance(value, (list, tuple)) else []
+
+
+class AttributeIndex:
+    """
+    Inverted indexes over the painting metadata, so a filter such as
+    {"artist": "Rembrandt", "year_max": 1700} compiles to a bitmap of
+    matching rows without scanning the frame.
+
+    - artist, source, medium, movement: rows grouped by value. A filter
+      value matches every catalog value containing it (case-insensitive),
+      and a list of values matches any of them.
+    - tags: rows grouped by tag (from the tag columns present). All listed
+      tags must match.
+    - year_min / year_max: row order sorted by year ("year" column, or the
+      first 3-4 digit number in date_display), cut with searchsorted.
+
+    Fields are ANDed. Compiled bitmaps are cached, and `selector` wraps
+    one as a FAISS IDSelector so the index search itself skips other rows
+    and still returns a full k results.
+    """
+
+    def __init__(self, metadata, cache_size=256):
+        self.num_rows = len(metadata)
+        self.postings = {}
+        for field, column in CATEGORICAL_FIELDS.items():
+            if column in metadata:
+                self.postings[field] = self._group(metadata[column].fillna("").astype(str).str.lower().to_numpy(), np.arange(self.num_rows))
+
+        tag_columns = [col for col in TAG_COLUMNS if col in metadata]
+        if tag_columns:
+            tags = pd.concat([metadata[col].map(_parse_tags).explode().dropna() for col in tag_columns])
+            self.postings["tags"] = self._group(tags.astype(str).str.lower().to_numpy(), metadata.index.get_indexer(tags.index))
+
+        if "year" in metadata:
+            years = pd.to_numeric(metadata["year"], errors="coerce")
+        else:
+            years = pd.to_numeric(metadata.get("date_display", pd.Series(index=metadata.index, dtype=object)).astype(str).str.extract(r"(\d{3,4})", expand=False), errors="coerce")
+        years = years.to_numpy(dtype="float64")
+        # Rows with a known year, sorted by it
+        self.year_rows = np.flatnonzero(~np.isnan(years))
+        self.year_rows = self.year_rows[np.argsort(years[self.year_rows], kind="stable")]
+        self.sorted_years = years[self.year_rows]
+
+        self._compile = lru_cache(maxsize=cache_size)(self._compile_key)
+
+    @staticmethod
+    def _group(values, rows):
+        """(unique values, rows sorted by value, offsets): rows[offsets[i]:offsets[i+1]] have values[i]."""
+        codes, uniques = pd.factorize(values)
+        order = np.argsort(codes, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(uniques)))])
+        return np.asarray(uniques, dtype=object), np.asarray(rows)[order], offsets
+
+    def _rows_matching(self, field, value, exact=False):
+        values, rows, offsets = self.postings[field]
+        value = str(value).lower()
+        matches = np.flatnonzero(values == value) if exact else [i for i, v in enumerate(values) if value in v]
+        if len(matches) == 0:
+            return np.empty(0, dtype="int64")
+        return np.concatenate([rows[offsets[i]:offsets[i + 1]] for i in matches])
+
+    @staticmethod
+    def key(filters):
+        """Hashable form of a filter dict (list values become sorted tuples)."""
+        return tuple(sorted(
+            (field, tuple(sorted(map(str, _as_list(value)))) if field not in ("year_min", "year_max") else value)
+            for field, value in (filters or {}).items()
+            if value is not None and value != [] and value != ""
+        ))
+
+    def validate(self, filters):
+        for field in (filters or {}):
+            if field not in FILTER_FIELDS:
+                raise ValueError(f"Unknown filter {field!r}; use one of {', '.join(FILTER_FIELDS)}")
+            if field not in ("year_min", "year_max") and field not in self.postings:
+                raise ValueError(f"Filter {field!r} is not available for this catalog")
+
+    def compile(self, filters):
+        """Boolean row bitmap for `filters`, or None when there is nothing to filter on."""
+        self.validate(filters)
+        key = self.key(filters)
+        return self._compile(key) if key else None
+
+    def _compile_key(self, key):
+        mask = np.ones(self.num_rows, dtype=bool)
+        filters = dict(key)
+
+        year_min, year_max = filters.pop("year_min", None), filters.pop("year_max", None)
+        if year_min is not None or year_max is not None:
+            lo = 0 if year_min is None else np.searchsorted(self.sorted_years, year_min, side="left")
+            hi = len(self.sorted_years) if year_max is None else np.searchsorted(self.sorted_years, year_max, side="right")
+            in_range = np.zeros(self.num_rows, dtype=bool)
+            in_range[self.year_rows[lo:hi]] = True
+            mask &= in_range
+
+        for field, values in filters.items():
+            if field == "tags":
+                for tag in values:
+                    field_mask = np.zeros(self.num_rows, dtype=bool)
+                    field_mask[self._rows_matching("tags", tag, exact=True)] = True
+                    mask &= field_mask
+            else:
+                field_mask = np.zeros(self.num_rows, dtype=bool)
+                for value in values:
+                    field_mask[self._rows_matching(field, value)] = True
+                mask &= field_mask
+
+        mask.flags.writeable = False  # shared through the cache
+        return mask
+
+    @staticmethod
+    def selector(mask):
+        """
+        FAISS IDSelectorBitmap over `mask`. The packed bits are attached to
+        the selector so they live as long as it does.
+        """
+        bits = np.packbits(mask, bitorder="little")
+        selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bits))
+        selector.bits = bits
+        return selector
+
+
+def search_parameters(index, selector):
+    """SearchParameters of the right type for `index`, keeping its nprobe / efSearch."""
+    index = getattr(index, "base_index", index)  # compressed.RerankedIndex
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
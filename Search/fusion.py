@@ -0,0 +1,62 @@
+import numpy as np
+
+
+FUSION_METHODS = ("rrf", "minmax", "zscore", "sum")
+
+
+def _normalize(scores, method):
+    if len(scores) == 0:
+        return scores
+    if method == "minmax":
+        low, high = scores.min(), scores.max()
+        return (scores - low) / (high - low) if high > low else np.ones_like(scores)
+    if method == "zscore":
+        std = scores.std()
+        return (scores - scores.mean()) / std if std > 0 else np.zeros_like(scores)
+    return scores  # "sum": raw scores, as in the original inner join
+
+
+def fuse(ids_list, scores_list, method="minmax", weights=None, rrf_k=60):
+    """
+    Fuse ranked lists from several models into one ranking.
+
+    ids_list / scores_list hold one FAISS result row per model, best first
+    (-1 ids are ignored). Items found by only some models are kept:
+
+    - rrf: sum of weight / (rrf_k + rank)
+    - minmax, zscore: weighted sum of per-list normalized scores
+    - sum: weighted sum of raw scores
+
+    A model that did not return an item contributes its lowest normalized
+    score for it (0 for rrf), since the item ranked below everything it
+    returned.
+
+    Returns (ids, scores, overlap): fused ids and scores sorted by score, and
+    the number of items every model returned.
+    """
+    weights = np.ones(len(ids_list)) if weights is None else np.asarray(weights, dtype="float64")
+
+    all_ids, contributions, floors = [], [], []
+    for ids, scores, weight in zip(ids_list, scores_list, weights):
+        ids, scores = np.asarray(ids), np.asarray(scores, dtype="float64")
+        valid = ids >= 0
+        ids, scores = ids[valid], scores[valid]
+        if method == "rrf":
+            contribution = weight / (rrf_k + np.arange(1, len(ids) + 1))
+            floor = 0.0
+        else:
+            normalized = _normalize(scores, method)
+            contribution = weight * normalized
+            floor = weight * normalized.min() if len(normalized) else 0.0
+        all_ids.append(ids)
+        contributions.append(contribution - floor)
+        floors.append(floor)
+
+    all_ids = np.concatenate(all_ids)
+    unique_ids, inverse = np.unique(all_ids, return_inverse=True)
+    # Every item starts at the sum of the floors; each model that found it adds its surplus
+    fused = np.bincount(inverse, weights=np.concatenate(contributions), minlength=len(unique_ids)) + sum(floors)
+    overlap = int(np.sum(np.bincount(inverse, minlength=len(unique_ids)) == len(ids_list)))
+
+    order = np.argsort(-fused, kind="stable")
+    return unique_ids[order], fused[order], overlap
@@ -1,142 +1,269 @@
 import os
+import sys
+import time
 import shutil
 import torch
 import open_clip
-import faiss
 
 import pandas as pd
 import numpy as np
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from sentence_transformers import SentenceTransformer
-from PIL import Image
+
+from fusion import fuse
+from filters import AttributeIndex, search_parameters
+from compressed import index_memory_bytes, load_index
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Common"))
+from contact_sheet import save_images as save_contact_sheet
 
 
 DATA_DIR = "../data"
 OUTPUT_DIR = "output_minmax"
 
+E5_MODEL = "intfloat/e5-large-v2"
+CLIP_MODEL = "ViT-SO400M-14-SigLIP-384"
+CLIP_PRETRAINED = "webli"
+
+
+class HybridSearcher:
+    """
+    Long-lived e5 + SigLIP text search: both models, both indexes and the
+    painting metadata are loaded once.
+
+    A query is encoded and searched by both models in parallel threads
+    (torch releases the GIL), then the two top-k lists are fused (see
+    fusion.py). Each call also returns per-stage timings in milliseconds.
+
+    With `compression` ("fp16", "sq8" or "pq", built by compressed.py) the
+    indexes hold compressed codes only, and candidates are re-ranked
+    exactly from the memory-mapped float32 embeddings.
+    """
+
+    def __init__(self, data_dir=DATA_DIR, device=None, compression=None, rerank_factor=2):
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+
+        self.compression = compression
+        self.e5_index = load_index(data_dir, "e5", compression, rerank_factor)
+        self.clip_index = load_index(data_dir, "clip", compression, rerank_factor)
+        self.metadata = pd.read_csv(os.path.join(data_dir, "paintings_v2.csv"))
+        self.attributes = AttributeIndex(self.metadata)
+
+        self.e5_model = SentenceTransformer(E5_MODEL, device=self.device)
+        self.clip_model, _, _ = open_clip.create_model_and_transforms(
+            CLIP_MODEL, pretrained=CLIP_PRETRAINED, device=self.device
+        )
+        self.clip_model.eval()
+        self.clip_tokenizer = open_clip.get_tokenizer(CLIP_MODEL)
+
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="search")
+
+    def _autocast(self):
+        return torch.cuda.amp.autocast() if self.device == "cuda" else nullcontext()
+
+    def encode_e5(self, queries, batch_size=32):
+        return self.e5_model.encode(["query: " + query for query in queries], batch_size=batch_size, normalize_embeddings=True)
+
+    def encode_clip(self, queries, batch_size=32):
+        tokens = self.clip_tokenizer(list(queries))
+        embeddings = []
+        with torch.no_grad(), self._autocast():
+            for start in range(0, len(tokens), batch_size):
+                embeddings.append(self.clip_model.encode_text(tokens[start:start + batch_size].to(self.device)).float().cpu().numpy())
+        query_embeddings = np.concatenate(embeddings)
+        query_embeddings /= np.linalg.norm(query_embeddings, axis=1, keepdims=True)
+        return query_embeddings
+
+    @staticmethod
+    def _timed(fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        return result, time.perf_counter() - start
+
+    @staticmethod
+    def _search(index, query_embeddings, k, params):
+        return index.search(query_embeddings, k, params=params)
+
+    def _encode_and_search(self, encode, index, queries, k, batch_size, params):
+        query_embeddings, encode_time = self._timed(encode, queries, batch_size)
+        (D, I), search_time = self._timed(self._search, index, query_embeddings, k, params)
+        return query_embeddings, D, I, encode_time, search_time
 
-def e5_search(query, model, index, k):
-    query_embedding = model.encode(query, normalize_embeddings=True)
-    D, I = index.search(query_embedding[None, :], k)
-    return D, I
+    @staticmethod
+    def _scores_for(D, I, rows):
+        """One model's raw scores for `rows` (NaN where it did not return the row)."""
+        valid = I >= 0  # FAISS pads with -1 when k exceeds the index size
+        return pd.Series(D[valid], index=I[valid]).reindex(rows).to_numpy()
 
+    def search_batch(self, queries, k=500, top_n=None, method="minmax", weights=None, min_overlap=25, max_k=4000, batch_size=32, filters=None):
+        """
+        Search many queries at once: each model encodes the whole batch and
+        each index answers it with one multi-row search, then the two top-k
+        lists are fused per query.
 
-def clip_search(query, tokenizer, model, index, k):
-    query = tokenizer(query)
-    query_embedding = model.encode_text(query).numpy()
-    query_embedding /= np.linalg.norm(query_embedding, axis=1, keepdims=True)
-    D, I = index.search(query_embedding, k)
-    return D, I
+        When a query's two lists share fewer than `min_overlap` items, the
+        indexes are searched again with k doubled (up to `max_k`) for those
+        queries only, reusing their embeddings. Metadata is joined for the
+        top_n rows of each query only.
+
+        `filters` (e.g. {"artist": "Rembrandt", "year_max": 1700}, see
+        filters.AttributeIndex) is compiled to a row bitmap and handed to
+        both index searches as an ID selector, so only matching paintings
+        are scored and k is not spent on rows that would be thrown away.
+
+        Returns (result frames in query order, timings in ms). Timings are
+        for the whole batch; "k", "rounds" and "overlap" are per-query lists.
+        """
+        queries = list(queries)
+        start = time.perf_counter()
+        mask = self.attributes.compile(filters)
+        num_selected = self.e5_index.ntotal if mask is None else int(np.count_nonzero(mask))
+        e5_params = clip_params = None
+        if mask is not None:
+            selector = self.attributes.selector(mask)  # must outlive both searches
+            e5_params = search_parameters(self.e5_index, selector)
+            clip_params = search_parameters(self.clip_index, selector)
+        k = max(1, min(k, num_selected))
+        filtered = time.perf_counter()
+
+        e5_future = self._executor.submit(self._encode_and_search, self.encode_e5, self.e5_index, queries, k, batch_size, e5_params)
+        clip_future = self._executor.submit(self._encode_and_search, self.encode_clip, self.clip_index, queries, k, batch_size, clip_params)
+        e5_embeddings, D_e5, I_e5, e5_encode, e5_search = e5_future.result()
+        clip_embeddings, D_clip, I_clip, clip_encode, clip_search = clip_future.result()
+        models_done = time.perf_counter()
+
+        # Per-query result rows; a query's rows are replaced when it is searched again with a larger k
+        hits = [(D_e5[i], I_e5[i], D_clip[i], I_clip[i]) for i in range(len(queries))]
+        ks = [k] * len(queries)
+        rounds = [1] * len(queries)
+
+        fused = [None] * len(queries)
+
+        def fuse_all(indices):
+            for i in indices:
+                scores_e5, ids_e5, scores_clip, ids_clip = hits[i]
+                fused[i] = fuse([ids_e5, ids_clip], [scores_e5, scores_clip], method=method, weights=weights)
+
+        _, fusion_time = self._timed(fuse_all, range(len(queries)))
+        max_k = min(max_k, self.e5_index.ntotal, self.clip_index.ntotal, num_selected)
+        while True:
+            pending = [i for i in range(len(queries)) if min_overlap and fused[i][2] < min_overlap and ks[i] < max_k]
+            if not pending:
+                break
+            k = min(2 * max(ks[i] for i in pending), max_k)
+            (D_e5, I_e5), search_time = self._timed(self._search, self.e5_index, e5_embeddings[pending], k, e5_params)
+            e5_search += search_time
+            (D_clip, I_clip), search_time = self._timed(self._search, self.clip_index, clip_embeddings[pending], k, clip_params)
+            clip_search += search_time
+            for row, i in enumerate(pending):
+                hits[i] = (D_e5[row], I_e5[row], D_clip[row], I_clip[row])
+                ks[i] = k
+                rounds[i] += 1
+            _, refuse_time = self._timed(fuse_all, pending)
+            fusion_time += refuse_time
+        fused_done = time.perf_counter()
+
+        results = []
+        for (ids, scores, _), (D_e5, I_e5, D_clip, I_clip) in zip(fused, hits):
+            rows = ids if top_n is None else ids[:top_n]
+            result = self.metadata.iloc[rows].copy()
+            result.insert(0, "score", scores[: len(rows)])
+            result.insert(1, "score_e5", self._scores_for(D_e5, I_e5, rows))
+            result.insert(2, "score_clip", self._scores_for(D_clip, I_clip, rows))
+            results.append(result)
+        end = time.perf_counter()
+
+        timings = {
+            "filter_ms": 1000 * (filtered - start),
+            "e5_encode_ms": 1000 * e5_encode,
+            "e5_search_ms": 1000 * e5_search,
+            "clip_encode_ms": 1000 * clip_encode,
+            "clip_search_ms": 1000 * clip_search,
+            "encoders_wall_ms": 1000 * (models_done - start),
+            "fusion_ms": 1000 * fusion_time,
+            "metadata_ms": 1000 * (end - fused_done),
+            "total_ms": 1000 * (end - start),
+            "k": ks,
+            "rounds": rounds,
+            "overlap": [overlap for _, _, overlap in fused],
+            "num_selected": num_selected,
+        }
+        return results, timings
+
+    def search(self, query, k=500, top_n=None, method="minmax", weights=None, min_overlap=25, max_k=4000, filters=None):
+        """Return (fused result frame sorted by score, timings in ms) for one query."""
+        (result,), timings = self.search_batch([query], k, top_n, method, weights, min_overlap, max_k, filters=filters)
+        timings.update({name: timings[name][0] for name in ("k", "rounds", "overlap")})
+        return result, timings
+
+    def memory_bytes(self):
+        return {"e5_index": index_memory_bytes(self.e5_index), "clip_index": index_memory_bytes(self.clip_index)}
+
+    def close(self):
+        self._executor.shutdown(wait=False)
 
 
 def save_images(filepath, image_ids, nrow=5):
-    # Load images
-    images = [Image.open(f"images/{image_id}.jpg") for image_id in image_ids]
-
-    # Calculate the size of the grid
-    nrows = (len(images) + nrow - 1) // nrow  # Calculate required number of rows
-    max_widths = [0] * nrow
-    max_heights = [0] * nrows
-    for i, img in enumerate(images):
-        row, col = divmod(i, nrow)
-        max_widths[col] = max(max_widths[col], img.width)
-        max_heights[row] = max(max_heights[row], img.height)
-
-    total_width = sum(max_widths)
-    total_height = sum(max_heights)
-
-    # Create a new blank image for the grid
-    grid_image = Image.new("RGB", (total_width, total_height))
-
-    # Paste images into the grid
-    y_offset = 0
-    for row in range(nrows):
-        x_offset = 0
-        for col in range(nrow):
-            if row * nrow + col < len(images):
-                grid_image.paste(images[row * nrow + col], (x_offset, y_offset))
-            x_offset += max_widths[col]
-        y_offset += max_heights[row]
-
-    grid_image.save(filepath)
+    # Grid of cached thumbnails (see Common/contact_sheet.py)
+    save_contact_sheet(filepath, image_ids, "images", nrow=nrow)
     print(f"Image saved as {filepath}")
 
 
 if __name__ == "__main__":
-    e5_index_path = os.path.join(DATA_DIR, f"artworks_e5.index")
     # ======================  Create Index  ====================== #
+    # e5_index_path = os.path.join(DATA_DIR, f"artworks_e5.index")
     # e5_embeddings = np.load(os.path.join(DATA_DIR, "search_embeds_e5_v2.npy"))
     # print(e5_embeddings.shape)
     # e5_index = create_faiss_index(e5_embeddings, e5_index_path)
 
-    e5_index = faiss.read_index(e5_index_path)
-
-    clip_index_path = os.path.join(DATA_DIR, f"artworks_clip.index")
-    # ======================  Create Index  ====================== #
+    # clip_index_path = os.path.join(DATA_DIR, f"artworks_clip.index")
     # clip_embeddings = np.load(os.path.join(DATA_DIR, "search_embeds_clip_v2.npy"))
     # print(clip_embeddings.shape)
     # clip_index = create_faiss_index(clip_embeddings, clip_index_path)
 
-    clip_index = faiss.read_index(clip_index_path)
-
-    metadata = pd.read_csv(os.path.join(DATA_DIR, "paintings_v2.csv"))
-    print(metadata.shape)
-
-    e5_model = SentenceTransformer("intfloat/e5-large-v2")
-
-    clip_model, _, _ = open_clip.create_model_and_transforms(
-        "ViT-SO400M-14-SigLIP-384", pretrained="webli"
-    )
-    clip_tokenizer = open_clip.get_tokenizer("ViT-SO400M-14-SigLIP-384")
-
-    with torch.no_grad(), torch.cuda.amp.autocast():
-        for query in [
-            "women in blue clothes",
-            "Gothic architecture",
-            "sport activities",
-            "crowd on a beach or a riverbank",
-            "Painting of joy",
-            "Vincent van Gogh",
-            "Vincent Vangogh",
-            "people celebrating cultural festivals or traditions",
-            "paintings showing agricultural life",
-            "Vincent van Gogh",
-            "pictures with large areas of red",
-            "colorful spring",
-            "bold color",
-            "pictures containing christian cross",
-            "Portraits of historical figures in the Renaissance era",
-            "warm, cozy feeling of autumn",
-            "cute cats",
-            "women with apple",
-            "apple still life",
-            "16th century",
-            "Polish Art",
-            "Artist portraits",
-            "loneliness and depression",
-            "paintings showcase youth and energy",
-            "Floral",
-            "Vase",
-            "Impressionism",
-            "Loose brushwork",
-            "Baroque Era",
-        ]:
-            filename = query.replace(" ", "_")
-
-            D, I = e5_search("query: " + query, e5_model, e5_index, 500)
-            e5_result = pd.DataFrame({"score": D[0]}, index=I[0])
-
-            D, I = clip_search(query, clip_tokenizer, clip_model, clip_index, 500)
-            clip_result = pd.DataFrame({"score": D[0]}, index=I[0])
-
-            result = e5_result.join(
-                clip_result, how="inner", lsuffix="_e5", rsuffix="_clip"
-            )
-            result["score"] = result["score_e5"] + result["score_clip"]
-            result = result.join(metadata, how="inner")
-            result.sort_values(by="score", ascending=False, inplace=True)
-            result.to_csv(os.path.join(OUTPUT_DIR, filename + ".csv"))
-            save_images(
-                os.path.join(OUTPUT_DIR, filename + ".jpg"),
-                result["image_id"].head(25),
-            )
+    searcher = HybridSearcher(DATA_DIR)
+    print(searcher.metadata.shape)
+
+    queries = [
+        "women in blue clothes",
+        "Gothic architecture",
+        "sport activities",
+        "crowd on a beach or a riverbank",
+        "Painting of joy",
+        "Vincent van Gogh",
+        "Vincent Vangogh",
+        "people celebrating cultural festivals or traditions",
+        "paintings showing agricultural life",
+        "Vincent van Gogh",
+        "pictures with large areas of red",
+        "colorful spring",
+        "bold color",
+        "pictures containing christian cross",
+        "Portraits of historical figures in the Renaissance era",
+        "warm, cozy feeling of autumn",
+        "cute cats",
+        "women with apple",
+        "apple still life",
+        "16th century",
+        "Polish Art",
+        "Artist portraits",
+        "loneliness and depression",
+        "paintings showcase youth and energy",
+        "Floral",
+        "Vase",
+        "Impressionism",
+        "Loose brushwork",
+        "Baroque Era",
+    ]
+    results, timings = searcher.search_batch(queries, 500)
+    print(len(queries), "queries", {name: round(ms, 1) for name, ms in timings.items() if name.endswith("_ms")})
+
+    for query, result in zip(queries, results):
+        filename = query.replace(" ", "_")
+        result.to_csv(os.path.join(OUTPUT_DIR, filename + ".csv"))
+        save_images(
+            os.path.join(OUTPUT_DIR, filename + ".jpg"),
+            result["image_id"].head(25),
+        )